@@ -0,0 +1,329 @@
+"""
+Throughput benchmark of the VK bulk methods against the local fake VK API.
+
+    python -m platforms.vk.benchmark bulk_check_post --ids 1,2,3 --latency 0.05 --rate-limit 3
+
+Starts `platforms.vk.fake_api` in-process, routes the worker's VK requests
+to it and runs the method on ids of existing rows of the configured
+database. Reports items per second, VK HTTP requests and execute calls
+per item, DB queries per item, JSON parse time per request and how many
+connections of the pooled client were opened and reused.
+
+Micro-benchmarks of single code paths need neither the fake API nor the
+database rows:
+
+    python -m platforms.vk.benchmark error_bodies --number 2000
+
+Every run is done in one transaction which is rolled back afterwards, so
+the deletes and stats writes of the methods do not touch the data;
+`--allow-writes` commits them instead. Tasks the methods send to other
+services are not rolled back.
+"""
+import argparse
+import asyncio
+import time
+import timeit
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import django
+from aiohttp import web
+
+# поле задачи с идентификаторами для каждого метода
+METHODS = {
+    'bulk_check_post': 'post_ids',
+    'get_likes_reposts': 'post_ids',
+    'refresh_posts': 'post_ids',
+    'get_stats_post': 'post_ids',
+    'get_stats_video': 'video_ids',
+    'get_stats_group': 'group_ids',
+    'bulk_delete_post': 'post_ids',
+    'bulk_delete_video': 'video_ids',
+}
+
+
+# тела ответов VK, которые не разбираются как JSON (в toggle_upload_link)
+ERROR_BODIES = {
+    'html_502': (
+        '<html>\r\n<head><title>502 Bad Gateway</title></head>\r\n<body>\r\n'
+        '<center><h1>502 Bad Gateway</h1></center>\r\n<hr><center>nginx</center>\r\n'
+        '</body>\r\n</html>\r\n'
+    ),
+    'html_unavailable': (
+        '<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>ВКонтакте</title>'
+        + '<link rel="stylesheet" href="/css/al/common.css">' * 40
+        + '</head><body><div class="message_page">Page temporary unavailable</div>'
+        + '<div class="footer"><a href="/about">О ВКонтакте</a></div>' * 200
+        + '</body></html>'
+    ),
+    'too_much_requests': 'Too much requests',
+    'json_error': '{"error":{"error_code":10,"error_msg":"Internal server error: could not',
+}
+
+
+def bench_error_bodies(number):
+    """classify_error_body against the BeautifulSoup check it replaced, per body."""
+    from platforms.vk.methods.vk_methods.video import classify_error_body
+
+    try:
+        from bs4 import BeautifulSoup
+    except ImportError:
+        BeautifulSoup = None
+
+    report = []
+    for name, body in ERROR_BODIES.items():
+        row = {
+            'body': name,
+            'size': len(body),
+            'kind': classify_error_body(body),
+            'classify_us': round(timeit.timeit(lambda: classify_error_body(body), number=number) / number * 1e6, 2),
+        }
+        if BeautifulSoup is not None:
+            row['bs4_is_html'] = bool(BeautifulSoup(body, 'html.parser').find())
+            row['bs4_us'] = round(
+                timeit.timeit(lambda: BeautifulSoup(body, 'html.parser').find(), number=number) / number * 1e6, 2
+            )
+        report.append(row)
+    return report
+
+
+def _synthetic_videos(count, owners=1, shuffle=True):
+    import random
+
+    videos = [
+        SimpleNamespace(pk=index + 1, vid=1000 + index, owner=-(index % owners) - 1, user_id=index % owners + 1,
+                        views=index, group_id=1, campaign_id=1)
+        for index in range(count)
+    ]
+    if shuffle:
+        random.Random(0).shuffle(videos)
+    return videos
+
+
+def bench_video_part(number):
+    """Matching of a 200-video part to its video.get response: vid index against the old linear filter."""
+    from platforms.vk.methods.get_stats_video import (
+        VIDEO_GET_SIZE,
+        GetStatsVideo
+    )
+
+    video_part = _synthetic_videos(VIDEO_GET_SIZE)
+    # video.get 3.0: первый элемент - количество, порядок элементов не совпадает с запросом
+    response = [len(video_part)] + [{'vid': video.vid, 'views': video.views + 1} for video in reversed(video_part)]
+
+    def linear_filter():
+        return [
+            (video, list(filter(lambda vid_dict: vid_dict.get('vid') == video.vid, response[1:]))[0])
+            for video in video_part
+        ]
+
+    assert len(GetStatsVideo._match_videos(video_part, response)) == len(linear_filter()) == VIDEO_GET_SIZE
+    return [{
+        'videos': VIDEO_GET_SIZE,
+        'index_us': round(
+            timeit.timeit(lambda: GetStatsVideo._match_videos(video_part, response), number=number) / number * 1e6, 2
+        ),
+        'linear_filter_us': round(timeit.timeit(linear_filter, number=number) / number * 1e6, 2),
+    }]
+
+
+# (видео, владельцы, токены): владельцы с одним токеном пакуются в общие execute
+VIDEO_PLAN_CASES = ((1000, 1, 1), (1000, 10, 10), (1000, 50, 5), (5000, 200, 20))
+
+
+def bench_video_plan(number):
+    """
+    Execute requests per 1000 videos: the old groupby over the unordered
+    queryset (one execute series per run of consecutive videos of an
+    owner) against GetStatsVideo._plan_video_calls.
+    """
+    from itertools import groupby
+    from math import ceil
+
+    from platforms.vk.execute_batcher import ExecuteBatcher
+    from platforms.vk.methods.get_stats_video import (
+        VIDEO_GET_SIZE,
+        GetStatsVideo
+    )
+
+    report = []
+    for videos_count, owners_count, tokens_count in VIDEO_PLAN_CASES:
+        videos = _synthetic_videos(videos_count, owners=owners_count)
+
+        old_requests = sum(
+            ceil(ceil(len(list(owner_videos)) / VIDEO_GET_SIZE) / ExecuteBatcher.BATCH_SIZE)
+            for _, owner_videos in groupby(videos, lambda video: video.owner)
+        )
+
+        videos_by_owner = {}
+        for video in sorted(videos, key=lambda video: video.owner):
+            videos_by_owner.setdefault(video.owner, []).append(video)
+        owners = [
+            (owner, 'token-{}'.format(owner % tokens_count), owner_videos)
+            for owner, owner_videos in videos_by_owner.items()
+        ]
+        calls_by_token = Counter(access_token for access_token, _, _ in GetStatsVideo._plan_video_calls(owners))
+        new_requests = sum(ceil(calls / ExecuteBatcher.BATCH_SIZE) for calls in calls_by_token.values())
+
+        report.append({
+            'videos': videos_count,
+            'owners': owners_count,
+            'tokens': tokens_count,
+            'groupby_requests': old_requests,
+            'planned_requests': new_requests,
+            'groupby_per_1000': round(old_requests * 1000 / videos_count, 1),
+            'planned_per_1000': round(new_requests * 1000 / videos_count, 1),
+        })
+    return report
+
+
+# микробенчмарки без fake API и строк БД
+MICRO_BENCHMARKS = {
+    'error_bodies': bench_error_bodies,
+    'video_part': bench_video_part,
+    'video_plan': bench_video_plan,
+}
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+async def start_fake_api(api, host='127.0.0.1', port=0):
+    from platforms.vk.fake_api import create_app
+
+    runner = web.AppRunner(create_app(api))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, 'http://{}:{}/method/'.format(host, port)
+
+
+async def run_benchmark(method_name, ids, api, repeat=1, allow_writes=False, **message_fields):
+    from django.db import connection, transaction
+
+    from platforms.vk import db
+    from platforms.vk.http import VkHttpClient
+    from platforms.vk.refresh import refresh_scheduler
+    from platforms.vk.scheduler import execute_scheduler
+    from platforms.vk.snapshots import post_snapshots
+    from platforms.vk.vk import VKPlatform
+
+    runner, api_url = await start_fake_api(api)
+    http = VkHttpClient(api_url=api_url)
+    execute_scheduler.use_http(http)
+    # каждый прогон опрашивает все объекты
+    refresh_scheduler.enabled = False
+
+    # один поток БД, чтобы счетчик запросов видел все запросы метода
+    db.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='vk-db')
+    counter = QueryCounter()
+    await db.run_db(connection.execute_wrappers.append, counter)
+    if not allow_writes:
+        # все запросы идут через этот единственный поток - одна транзакция на прогон
+        await db.run_db(transaction.set_autocommit, False)
+
+    platform = VKPlatform()
+    method = getattr(platform, method_name)
+    task_message = SimpleNamespace(priority=None, **{METHODS[method_name]: ids}, **message_fields)
+
+    report = []
+    try:
+        for _ in range(repeat):
+            post_snapshots.clear()
+            api.stats.clear()
+            http.stats.clear()
+            counter.count = 0
+
+            started_at = time.monotonic()
+            try:
+                await method(task_message)
+            finally:
+                if not allow_writes:
+                    await db.run_db(transaction.rollback)
+            elapsed = time.monotonic() - started_at
+
+            report.append({
+                'items': len(ids),
+                'seconds': round(elapsed, 3),
+                'items_per_second': round(len(ids) / elapsed, 1) if elapsed else None,
+                'requests_per_item': round(api.stats['requests'] / len(ids), 3),
+                'calls_per_item': round(api.stats['calls'] / len(ids), 3),
+                'queries_per_item': round(counter.count / len(ids), 3),
+                'parse_ms_per_request': round(
+                    http.stats['parse_seconds'] * 1000 / http.stats['requests'], 4
+                ) if http.stats['requests'] else None,
+                'connections_created': http.stats['connections_created'],
+                'connections_reused': http.stats['connections_reused'],
+                'errors': api.stats['errors'] + api.stats['call_errors']
+            })
+    finally:
+        if not allow_writes:
+            await db.run_db(transaction.set_autocommit, True)
+        await http.close()
+        await runner.cleanup()
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the VK bulk methods against the fake VK API')
+    parser.add_argument('method', choices=sorted(METHODS) + sorted(MICRO_BENCHMARKS))
+    parser.add_argument('--ids', help='comma separated ids of existing rows')
+    parser.add_argument('--number', type=int, default=1000, help='iterations of a micro-benchmark')
+    parser.add_argument('--user-id', type=int, help='bulk_delete_* owner')
+    parser.add_argument('--campaign-id', type=int, help='get_stats_group campaign')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--allow-writes', action='store_true',
+                        help='commit what the method writes instead of rolling it back')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int, default=None)
+    parser.add_argument('--execute-error-rate', type=float, default=0.0)
+    parser.add_argument('--access-denied-rate', type=float, default=0.0)
+    parser.add_argument('--too-many-requests-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    django.setup()
+    if args.method in MICRO_BENCHMARKS:
+        for row in MICRO_BENCHMARKS[args.method](args.number):
+            print(', '.join('{}={}'.format(key, value) for key, value in row.items()))
+        return
+
+    if not args.ids:
+        parser.error('--ids is required for {}'.format(args.method))
+
+    from platforms.vk.fake_api import FakeVkApi
+
+    api = FakeVkApi(
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+        execute_error_rate=args.execute_error_rate,
+        access_denied_rate=args.access_denied_rate,
+        too_many_requests_rate=args.too_many_requests_rate,
+        seed=0
+    )
+
+    message_fields = {}
+    if args.user_id is not None:
+        message_fields['user_id'] = args.user_id
+    if args.campaign_id is not None:
+        message_fields['campaign_id'] = args.campaign_id
+
+    ids = [int(pk) for pk in args.ids.split(',') if pk]
+    report = asyncio.get_event_loop().run_until_complete(
+        run_benchmark(args.method, ids, api, repeat=args.repeat, allow_writes=args.allow_writes, **message_fields)
+    )
+
+    for number, row in enumerate(report, 1):
+        print('run {}: {}'.format(number, ', '.join('{}={}'.format(key, value) for key, value in row.items())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import hashlib
+from collections import defaultdict
+from datetime import datetime
+
+from django.db import (
+    connection,
+    transaction
+)
+from django.db.models import F
+from django.utils import timezone
+
+from core.models import PostStats
+from core.models.stats import ViewsStat
+from core.models.vk import UnitedPostsStat
+
+
+def assign_changed(instance, **fields) -> set:
+    """Sets the fields on the instance and returns names of those whose value changed."""
+    changed = set()
+    for field, value in fields.items():
+        if getattr(instance, field) != value:
+            setattr(instance, field, value)
+            changed.add(field)
+    return changed
+
+
+class StatusCollector:
+    """
+    Gathers status / vk_response changes of entities during a batch and
+    writes them with a constant number of queries: one grouped UPDATE per
+    status value plus one `bulk_update` for entities with a new vk_response.
+    """
+
+    def __init__(self, model):
+        self._model = model
+        self._entities = {}
+        self._with_response = set()
+
+    def __len__(self):
+        return len(self._entities)
+
+    def set(self, entity, status, vk_response=None):
+        entity.status = status
+        self._entities[entity.pk] = entity
+
+        if vk_response is not None:
+            entity.vk_response = vk_response
+            self._with_response.add(entity.pk)
+
+    def flush(self):
+        pks_by_status = defaultdict(list)
+        with_response = []
+
+        for pk, entity in self._entities.items():
+            if pk in self._with_response:
+                with_response.append(entity)
+            else:
+                pks_by_status[entity.status].append(pk)
+
+        for status, pks in pks_by_status.items():
+            self._model.objects.filter(pk__in=pks).update(status=status)
+
+        if with_response:
+            self._model.objects.bulk_update(with_response, ['status', 'vk_response'])
+
+        self._entities.clear()
+        self._with_response.clear()
+
+
+class PostStatsUpserter:
+    """
+    Upserts PostStats of a batch of posts with a constant number of queries.
+
+    Existing rows are preloaded with one query, missing ones are created
+    with `bulk_create` and changed rows are written with `bulk_update`
+    limited to the fields that actually changed. Rows whose values did not
+    change are not written at all. A row created meanwhile by another
+    worker is not a conflict: it is re-read and updated like an existing one.
+    """
+
+    def __init__(self, posts):
+        self._model = PostStats
+        self._posts = {post.pk: post for post in posts}
+        self._stats = {
+            post_stats.post_id: post_stats
+            for post_stats in PostStats.objects.filter(post_id__in=list(self._posts))
+        }
+        self._new = {}
+        self._changed = defaultdict(set)
+
+    def get(self, post):
+        post_stats = self._stats.get(post.pk)
+        if post_stats is None:
+            post_stats = self._stats[post.pk] = self._new[post.pk] = self._model(post=post)
+        return post_stats
+
+    def set(self, post, **fields):
+        changed = assign_changed(self.get(post), **fields)
+        if changed:
+            self._changed[post.pk] |= changed
+
+    def flush(self):
+        if self._new:
+            self._model.objects.bulk_create(list(self._new.values()), ignore_conflicts=True)
+
+            # pk вставленных строк неизвестны, а часть строк могла создать другая задача:
+            # перечитываем их и дописываем наши значения обычным bulk_update
+            for post_stats in self._model.objects.filter(post_id__in=list(self._new)):
+                new_stats = self._new[post_stats.post_id]
+                fields = self._changed.pop(post_stats.post_id, ())
+                changed = assign_changed(post_stats, **{field: getattr(new_stats, field) for field in fields})
+                if changed:
+                    self._changed[post_stats.post_id] = changed
+                self._stats[post_stats.post_id] = post_stats
+
+        stats_by_fields = defaultdict(list)
+        for post_id, fields in self._changed.items():
+            if post_id in self._stats and self._stats[post_id].pk is not None:
+                stats_by_fields[frozenset(fields)].append(self._stats[post_id])
+
+        for fields, stats in stats_by_fields.items():
+            self._model.objects.bulk_update(stats, sorted(fields))
+
+        self._new.clear()
+        self._changed.clear()
+
+
+def ensure_post_stats(post_ids):
+    """Creates missing PostStats rows of the given posts with one `bulk_create`."""
+    post_ids = set(post_ids)
+    existing = set(PostStats.objects.filter(post_id__in=post_ids).values_list('post_id', flat=True))
+
+    # строки, созданные параллельно другой задачей, пропускаются
+    PostStats.objects.bulk_create(
+        [PostStats(post_id=post_id) for post_id in post_ids - existing],
+        ignore_conflicts=True
+    )
+
+
+def ensure_united_posts_stats(posts):
+    """Creates missing UnitedPostsStat rows for (user, group, campaign) of the posts."""
+    keys = {(post.user_id, post.group_id, post.campaign_id) for post in posts}
+    if not keys:
+        return
+
+    existing = set(UnitedPostsStat.objects.filter(
+        user_id__in={key[0] for key in keys},
+        group_id__in={key[1] for key in keys},
+        campaign_id__in={key[2] for key in keys},
+    ).values_list('user_id', 'group_id', 'campaign_id'))
+
+    UnitedPostsStat.objects.bulk_create([
+        UnitedPostsStat(user_id=user_id, group_id=group_id, campaign_id=campaign_id)
+        for user_id, group_id, campaign_id in keys - existing
+    ], ignore_conflicts=True)
+
+
+class ViewsStatAggregator:
+    """
+    Sums view deltas of a whole job per (group, campaign, user, date) and
+    writes every key once with an atomic `F('views') + delta` UPDATE, so
+    concurrent workers do not lose each other's increments. Only a missing
+    row takes a lock: a transaction-level advisory lock on the key, so two
+    workers cannot both create the row for the same day.
+    """
+
+    def __init__(self):
+        self._deltas = defaultdict(int)
+
+    def __len__(self):
+        return len(self._deltas)
+
+    def add(self, group_id, campaign_id, user_id, delta, date=None):
+        if date is None:
+            date = timezone.make_aware(datetime.now(), timezone.get_default_timezone()).date()
+        # ключ учитывается и при нулевой разнице - строка за день должна существовать
+        self._deltas[(group_id, campaign_id, user_id, date)] += delta
+
+    @staticmethod
+    def _lock_key(group_id, campaign_id, user_id, date) -> int:
+        digest = hashlib.sha1('views-stat:{}:{}:{}:{}'.format(group_id, campaign_id, user_id, date).encode())
+        return int.from_bytes(digest.digest()[:8], 'big', signed=True)
+
+    def flush(self):
+        for key, delta in self._deltas.items():
+            group_id, campaign_id, user_id, date = key
+            stats = ViewsStat.objects.filter(
+                group_id=group_id,
+                campaign_id=campaign_id,
+                user_id=user_id,
+                date__contains=date
+            )
+
+            if not delta:
+                if stats.exists():
+                    continue
+            elif stats.update(views=F('views') + delta):
+                continue
+
+            # строки за день нет: создаем под блокировкой ключа, иначе два воркера
+            # создадут по строке, и каждое следующее UPDATE прибавит прирост к обеим
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_xact_lock(%s)', [self._lock_key(*key)])
+
+                if not stats.update(views=F('views') + delta):
+                    ViewsStat.objects.create(
+                        group_id=group_id,
+                        campaign_id=campaign_id,
+                        user_id=user_id,
+                        views=delta
+                    )
+
+        self._deltas.clear()
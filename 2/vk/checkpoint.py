@@ -0,0 +1,33 @@
+import hashlib
+
+from django.core.cache import cache
+
+from application import settings
+
+VK_CHECKPOINT_TTL = getattr(settings, 'VK_CHECKPOINT_TTL', 24 * 60 * 60)
+
+
+class JobCheckpoint:
+    """
+    Progress of a chunked job over a set of ids, kept in the Django cache.
+
+    The key is derived from the job name and its ids, so a restarted job
+    with the same ids resumes after the last persisted chunk.
+    """
+
+    KEY = 'vk-checkpoint:{}:{}'
+
+    def __init__(self, name, ids, cache=cache, ttl=VK_CHECKPOINT_TTL):
+        digest = hashlib.sha1(','.join(str(pk) for pk in sorted(ids)).encode()).hexdigest()
+        self._key = self.KEY.format(name, digest)
+        self._cache = cache
+        self._ttl = ttl
+
+    def load(self, default=0):
+        return self._cache.get(self._key, default)
+
+    def save(self, position):
+        self._cache.set(self._key, position, self._ttl)
+
+    def clear(self):
+        self._cache.delete(self._key)
@@ -0,0 +1,93 @@
+import time
+
+from django.db.models.signals import (
+    post_delete,
+    post_save
+)
+from django.dispatch import receiver
+from social_django.models import UserSocialAuth
+
+from application import settings
+from platforms.utils import VK_MESSAGE_KEY
+
+AUTH_PROVIDER = 'vk-oauth2'
+# error_code 5: User authorization failed
+AUTH_ERROR_CODES = (5,)
+
+VK_CREDENTIALS_TTL = getattr(settings, 'VK_CREDENTIALS_TTL', 300)
+
+
+class CredentialsCache:
+    """
+    Process-local TTL cache of VK (social_uid, access_token) per user id.
+
+    Entries are dropped when the social auth row changes or when VK
+    rejects the token, so a refreshed token is picked up on the next call.
+    """
+
+    def __init__(self, provider=AUTH_PROVIDER, ttl=VK_CREDENTIALS_TTL):
+        self._provider = provider
+        self._ttl = ttl
+        self._items = {}
+        self._token_owners = {}
+
+    def _store(self, social_auth):
+        credentials = social_auth.uid, social_auth.extra_data['access_token']
+        self._items[social_auth.user_id] = (time.monotonic() + self._ttl, credentials)
+        self._token_owners[credentials[1]] = social_auth.user_id
+        return credentials
+
+    def _get_fresh(self, user_id):
+        item = self._items.get(user_id)
+        if item is None:
+            return None
+
+        expires_at, credentials = item
+        if expires_at < time.monotonic():
+            self.invalidate(user_id)
+            return None
+        return credentials
+
+    def get(self, user_id):
+        credentials = self._get_fresh(user_id)
+        if credentials is None:
+            social_auth = UserSocialAuth.objects.get(user_id=user_id, provider=self._provider)
+            credentials = self._store(social_auth)
+        return credentials
+
+    def prefetch(self, user_ids):
+        """Loads credentials of all given users with a single query."""
+        missing = [user_id for user_id in set(user_ids) if self._get_fresh(user_id) is None]
+        if not missing:
+            return
+
+        for social_auth in UserSocialAuth.objects.filter(user_id__in=missing, provider=self._provider):
+            self._store(social_auth)
+
+    def invalidate(self, user_id):
+        item = self._items.pop(user_id, None)
+        if item is not None:
+            self._token_owners.pop(item[1][1], None)
+
+    def invalidate_token(self, access_token):
+        user_id = self._token_owners.get(access_token)
+        if user_id is not None:
+            self.invalidate(user_id)
+
+    def clear(self):
+        self._items.clear()
+        self._token_owners.clear()
+
+
+def is_auth_error(error_dict) -> bool:
+    return bool(error_dict) and error_dict.get(VK_MESSAGE_KEY.ERROR_CODE) in AUTH_ERROR_CODES
+
+
+credentials_cache = CredentialsCache()
+
+
+@receiver(post_save, sender=UserSocialAuth)
+@receiver(post_delete, sender=UserSocialAuth)
+def invalidate_credentials(sender, instance, **kwargs):
+    if instance.provider == AUTH_PROVIDER:
+        credentials_cache.invalidate(instance.user_id)
@@ -0,0 +1,90 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+
+from application import settings
+from application.settings import StatsClient
+from platforms.vk import logger
+
+VK_DB_THREADS = getattr(settings, 'VK_DB_THREADS', 4)
+VK_LOOP_LAG_INTERVAL = getattr(settings, 'VK_LOOP_LAG_INTERVAL', 1.0)
+
+db_executor = ThreadPoolExecutor(max_workers=VK_DB_THREADS, thread_name_prefix='vk-db')
+
+
+def _call(func, args, kwargs):
+    # соединение потока переиспользуется между вызовами, закрывается только сломанное
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+        raise
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Runs synchronous ORM code in the bounded DB thread pool, so a slow
+    query does not stall the VK requests in flight on the event loop.
+    """
+    loop_lag_monitor.start()
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(_call, func, args, kwargs))
+
+
+def db_call(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up from a sleep of `interval`
+    seconds: lag close to zero means nothing blocks the loop.
+    """
+
+    METRIC = 'vk-worker__loop_lag'
+
+    def __init__(self, interval=VK_LOOP_LAG_INTERVAL):
+        self._interval = interval
+        self._task = None
+
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+
+    @property
+    def avg_lag(self) -> float:
+        return self.total_lag / self.samples if self.samples else 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started_at = time.monotonic()
+            await asyncio.sleep(self._interval)
+            lag = max(0.0, time.monotonic() - started_at - self._interval)
+
+            self.samples += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+
+            try:
+                StatsClient.event(self.METRIC, value=round(lag * 1000, 3))
+            except Exception as e:
+                logger.error(e)
+
+
+loop_lag_monitor = LoopLagMonitor()
@@ -0,0 +1,199 @@
+import asyncio
+
+from platforms.utils import VK_MESSAGE_KEY
+from platforms.vk.credentials import (
+    credentials_cache,
+    is_auth_error
+)
+from platforms.vk.methods.vk_methods.execute import (
+    ExecuteMethod,
+    VideoExecuteMethod
+)
+from platforms.vk.resilience import (
+    VK_RETRY_ATTEMPTS,
+    backoff_delay,
+    call_with_retry,
+    is_retryable_error
+)
+from platforms.vk.scheduler import execute_scheduler
+
+
+class ExecuteResult:
+    """
+    Result of a single API call packed into an `execute` request.
+
+    `response` is the call's own item of the execute response list and
+    `error` is its `execute_errors` entry (or the request-wide error).
+    `response_dict` is the whole execute response the call was part of.
+    """
+
+    def __init__(self, entity, response=None, error=None, response_dict=None):
+        self.entity = entity
+        self.response = response
+        self.error = error
+        self.response_dict = response_dict
+
+    @property
+    def is_request_failed(self) -> bool:
+        return not self.response_dict or VK_MESSAGE_KEY.ERROR in self.response_dict
+
+    @property
+    def is_failed(self) -> bool:
+        return self.is_request_failed or self.response is False or self.response is None
+
+
+def failed_responses(results) -> list:
+    """Unique execute responses which failed as a whole."""
+    responses = {}
+    for result in results:
+        if result.is_request_failed:
+            responses.setdefault(id(result.response_dict), result.response_dict)
+    return list(responses.values())
+
+
+def split_by_request(results) -> list:
+    """Groups results by the execute request they were sent in."""
+    requests = {}
+    for result in results:
+        requests.setdefault(id(result.response_dict), []).append(result)
+    return list(requests.values())
+
+
+class _PendingCall:
+    def __init__(self, call, entity, future):
+        self.call = call
+        self.entity = entity
+        self.future = future
+        self.attempts = 0
+
+
+class ExecuteBatcher:
+    """
+    Packs API calls of the same access token into `execute` requests of up
+    to `BATCH_SIZE` calls and routes every call's result back to its entity.
+
+    A batcher instance is shared by the whole worker, so calls coming from
+    different tasks with the same token and priority fill the same execute
+    request. A partially filled request is sent after `linger` seconds.
+    Requests are dispatched concurrently through `scheduler`, which keeps
+    every token within its rate limit.
+
+    Throttled or failed execute requests are retried with jittered backoff
+    behind a circuit breaker per (token, method); calls which failed with
+    a retryable error inside a successful execute go back into the queue
+    and are sent again with the next batch of the same token.
+    """
+
+    BATCH_SIZE = 25
+
+    def __init__(self, method_class=ExecuteMethod, linger=0.01, scheduler=execute_scheduler,
+                 retry_attempts=VK_RETRY_ATTEMPTS):
+        self._method_class = method_class
+        self._linger = linger
+        self._scheduler = scheduler
+        self._retry_attempts = retry_attempts
+
+        self._queues = {}
+        self._timers = {}
+
+    async def call(self, access_token, call, entity=None, priority=None) -> ExecuteResult:
+        future = asyncio.get_event_loop().create_future()
+        self._enqueue((access_token, priority), _PendingCall(call, entity, future))
+        return await future
+
+    def _enqueue(self, key, pending):
+        queue = self._queues.setdefault(key, [])
+        queue.append(pending)
+
+        if len(queue) >= self.BATCH_SIZE:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = asyncio.get_event_loop().call_later(self._linger, self._flush, key)
+
+    async def run(self, items, priority=None) -> list:
+        """
+        Executes (access_token, call, entity) items and returns their
+        `ExecuteResult`s in the same order.
+        """
+        return await asyncio.gather(*(
+            self.call(access_token, call, entity, priority)
+            for access_token, call, entity in items
+        ))
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+        queue = self._queues.pop(key, [])
+        access_token, priority = key
+
+        for index in range(0, len(queue), self.BATCH_SIZE):
+            batch = queue[index:index + self.BATCH_SIZE]
+            asyncio.ensure_future(self._dispatch(access_token, priority, batch))
+
+    async def _dispatch(self, access_token, priority, batch):
+        code = ExecuteMethod.construct_code([pending.call for pending in batch])
+
+        def send():
+            method = self._method_class(priority=priority, access_token=access_token, code=code)
+            return self._scheduler.execute(access_token, method)
+
+        try:
+            response_dict = await call_with_retry(
+                send,
+                key=(access_token, self._method_class.METHOD),
+                attempts=self._retry_attempts
+            )
+        except Exception as e:
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+
+        if response_dict and is_auth_error(response_dict.get(VK_MESSAGE_KEY.ERROR)):
+            credentials_cache.invalidate_token(access_token)
+
+        loop = asyncio.get_event_loop()
+        for pending, result in zip(batch, self.route(batch, response_dict)):
+            if pending.future.done():
+                continue
+
+            if self._should_retry(pending, result):
+                # упавший вызов возвращается в очередь текущей задачи, а не теряется
+                pending.attempts += 1
+                loop.call_later(backoff_delay(pending.attempts), self._enqueue, (access_token, priority), pending)
+                continue
+
+            pending.future.set_result(result)
+
+    def _should_retry(self, pending, result) -> bool:
+        return (
+            not result.is_request_failed and
+            result.is_failed and
+            is_retryable_error(result.error) and
+            pending.attempts + 1 < self._retry_attempts
+        )
+
+    @staticmethod
+    def route(batch, response_dict) -> list:
+        entities = [pending.entity for pending in batch]
+
+        if not response_dict or VK_MESSAGE_KEY.ERROR in response_dict:
+            error = response_dict.get(VK_MESSAGE_KEY.ERROR) if response_dict else None
+            return [ExecuteResult(entity, error=error, response_dict=response_dict) for entity in entities]
+
+        response_list = response_dict.get(VK_MESSAGE_KEY.RESPONSE) or []
+        # execute_errors идут в том же порядке, что и упавшие вызовы
+        errors = iter(response_dict.get(VK_MESSAGE_KEY.EXECUTE_ERRORS) or [])
+
+        results = []
+        for index, entity in enumerate(entities):
+            response = response_list[index] if index < len(response_list) else None
+            error = next(errors, None) if response is False or response is None else None
+            results.append(ExecuteResult(entity, response=response, error=error, response_dict=response_dict))
+        return results
+
+
+execute_batcher = ExecuteBatcher(ExecuteMethod)
+video_execute_batcher = ExecuteBatcher(VideoExecuteMethod)
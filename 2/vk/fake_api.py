@@ -0,0 +1,299 @@
+"""
+Local stand-in for the VK API, for load and performance testing of the
+VK methods without touching real VK.
+
+Implements `execute` (parses the `API.entity.method({...})` calls built by
+`ExecuteMethod.construct`) and the `wall.*`, `video.*`, `stats.*` and
+`groups.get` methods used by the worker. Latency, per-token rate limits
+and error injection are configurable:
+
+    python -m platforms.vk.fake_api --port 8090 --latency 0.05 --rate-limit 3 --execute-error-rate 0.01
+
+and point the worker at it with VK_API_URL = 'http://127.0.0.1:8090/method/'
+and VK_POOLED_HTTP = True.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from collections import Counter
+
+from aiohttp import web
+
+from platforms.utils import VK_MESSAGE_KEY
+
+CALL_RE = re.compile(r'API\.(\w+)\.(\w+)\(')
+
+# коды ошибок VK
+TOO_MANY_REQUESTS = 6
+ACCESS_DENIED = 15
+INTERNAL_ERROR = 10
+
+
+class FakeVkError(Exception):
+    def __init__(self, code, msg):
+        super(FakeVkError, self).__init__(msg)
+        self.code = code
+        self.msg = msg
+
+    def to_dict(self, method=None):
+        error = {
+            VK_MESSAGE_KEY.ERROR_CODE: self.code,
+            VK_MESSAGE_KEY.ERROR_MSG: self.msg
+        }
+        if method is not None:
+            error['method'] = method
+        return error
+
+
+def parse_execute_code(code: str) -> list:
+    """`return [API.wall.getById({...}),...];` -> [('wall.getById', {...}), ...]"""
+    decoder = json.JSONDecoder()
+    calls = []
+    position = 0
+    while True:
+        match = CALL_RE.search(code, position)
+        if match is None:
+            return calls
+
+        arguments, end = decoder.raw_decode(code, match.end())
+        calls.append(('{}.{}'.format(match.group(1), match.group(2)), arguments))
+        position = end
+
+
+def _split_ids(value):
+    return [item for item in str(value).split(',') if item]
+
+
+class FakeVkApi:
+    """
+    In-memory VK: posts, videos and groups are generated on demand from
+    their ids, so any id the worker asks for exists unless deleted.
+    Views, reach, likes and reposts grow on every read.
+    """
+
+    def __init__(self, latency=0.0, rate_limit=None, execute_error_rate=0.0, access_denied_rate=0.0,
+                 too_many_requests_rate=0.0, groups_per_user=50, seed=None):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.execute_error_rate = execute_error_rate
+        self.access_denied_rate = access_denied_rate
+        self.too_many_requests_rate = too_many_requests_rate
+        self.groups_per_user = groups_per_user
+
+        self._random = random.Random(seed)
+        self._windows = {}
+        self._counters = Counter()
+        self.deleted = set()
+        self.stats = Counter()
+
+    # --- инфраструктура ---
+
+    def _check_rate_limit(self, access_token):
+        if self.rate_limit is None:
+            return
+
+        window = int(time.monotonic())
+        window_id, used = self._windows.get(access_token, (window, 0))
+        if window_id != window:
+            window_id, used = window, 0
+
+        if used >= self.rate_limit:
+            self.stats['rate_limited'] += 1
+            raise FakeVkError(TOO_MANY_REQUESTS, 'Too many requests per second')
+        self._windows[access_token] = (window_id, used + 1)
+
+    def _grow(self, key, step=10):
+        self._counters[key] += self._random.randint(0, step)
+        return self._counters[key]
+
+    def _maybe_fail(self):
+        if self._random.random() < self.access_denied_rate:
+            raise FakeVkError(ACCESS_DENIED, 'Access denied')
+        if self._random.random() < self.execute_error_rate:
+            raise FakeVkError(INTERNAL_ERROR, 'Internal server error')
+
+    async def handle(self, request: web.Request) -> web.Response:
+        params = dict(request.query)
+        if request.method == 'POST':
+            params.update(await request.post())
+
+        method = request.match_info['method']
+        self.stats['requests'] += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        try:
+            self._check_rate_limit(params.get('access_token'))
+            if self._random.random() < self.too_many_requests_rate:
+                raise FakeVkError(TOO_MANY_REQUESTS, 'Too many requests per second')
+
+            if method == 'execute':
+                body = self.execute(params.get('code', ''))
+            else:
+                body = {VK_MESSAGE_KEY.RESPONSE: self.call(method, params)}
+        except FakeVkError as e:
+            self.stats['errors'] += 1
+            body = {VK_MESSAGE_KEY.ERROR: e.to_dict()}
+
+        return web.json_response(body)
+
+    def execute(self, code: str) -> dict:
+        responses, errors = [], []
+        for method, arguments in parse_execute_code(code):
+            self.stats['calls'] += 1
+            try:
+                self._maybe_fail()
+                responses.append(self.call(method, arguments))
+            except FakeVkError as e:
+                self.stats['call_errors'] += 1
+                responses.append(False)
+                errors.append(e.to_dict(method))
+
+        body = {VK_MESSAGE_KEY.RESPONSE: responses}
+        if errors:
+            body[VK_MESSAGE_KEY.EXECUTE_ERRORS] = errors
+        return body
+
+    def call(self, method: str, arguments: dict):
+        handler = getattr(self, method.replace('.', '_'), None)
+        if handler is None:
+            raise FakeVkError(3, 'Unknown method passed: {}'.format(method))
+        return handler(arguments)
+
+    # --- методы API ---
+
+    def wall_getById(self, arguments):
+        items = []
+        for full_id in _split_ids(arguments.get(VK_MESSAGE_KEY.POSTS, '')):
+            owner_id, post_id = (int(part) for part in full_id.split('_'))
+            if (owner_id, post_id) in self.deleted:
+                continue
+
+            items.append({
+                VK_MESSAGE_KEY.ID: post_id,
+                VK_MESSAGE_KEY.OWNER_ID: owner_id,
+                VK_MESSAGE_KEY.LIKES: {VK_MESSAGE_KEY.COUNT: self._grow(('likes', owner_id, post_id), 3)},
+                VK_MESSAGE_KEY.REPOSTS: {VK_MESSAGE_KEY.COUNT: self._grow(('reposts', owner_id, post_id), 1)},
+                VK_MESSAGE_KEY.ATTACHMENT: [{'type': 'video'}]
+            })
+        return items
+
+    def wall_delete(self, arguments):
+        key = int(arguments[VK_MESSAGE_KEY.OWNER_ID]), int(arguments[VK_MESSAGE_KEY.POST_ID])
+        if key in self.deleted:
+            raise FakeVkError(ACCESS_DENIED, 'Access denied')
+        self.deleted.add(key)
+        return 1
+
+    def wall_post(self, arguments):
+        self._counters['wall_post'] += 1
+        return {VK_MESSAGE_KEY.POST_ID: self._counters['wall_post']}
+
+    def wall_repost(self, arguments):
+        self._counters['wall_post'] += 1
+        return {'success': 1, VK_MESSAGE_KEY.POST_ID: self._counters['wall_post']}
+
+    def video_get(self, arguments):
+        owner_id = arguments.get(VK_MESSAGE_KEY.OWNER_ID)
+        items = []
+        for full_id in _split_ids(arguments.get(VK_MESSAGE_KEY.VIDEOS, '')):
+            video_owner, vid = (int(part) for part in full_id.split('_'))
+            if (video_owner, vid) in self.deleted:
+                continue
+            items.append({'vid': vid, 'owner_id': owner_id, 'views': self._grow(('views', video_owner, vid), 50)})
+
+        # video.get версии 3.0: первый элемент - количество видео
+        return [len(items)] + items
+
+    def video_delete(self, arguments):
+        key = int(arguments[VK_MESSAGE_KEY.OWNER_ID]), int(arguments[VK_MESSAGE_KEY.VIDEO_ID])
+        if key in self.deleted:
+            raise FakeVkError(ACCESS_DENIED, 'Access denied')
+        self.deleted.add(key)
+        return 1
+
+    def video_save(self, arguments):
+        self._counters['video'] += 1
+        return {
+            VK_MESSAGE_KEY.VIDEO_ID: self._counters['video'],
+            VK_MESSAGE_KEY.OWNER_ID: arguments.get('group_id') or 1,
+            VK_MESSAGE_KEY.UPLOAD_URL: 'http://127.0.0.1/upload'
+        }
+
+    def stats_getPostReach(self, arguments):
+        owner_id = arguments.get(VK_MESSAGE_KEY.OWNER_ID)
+        post_ids = _split_ids(arguments.get('post_ids') or arguments.get(VK_MESSAGE_KEY.POST_ID, ''))
+        items = []
+        for post_id in post_ids:
+            reach = self._grow(('reach', owner_id, post_id), 100)
+            items.append({
+                VK_MESSAGE_KEY.POST_ID: int(post_id),
+                'reach_subscribers': reach // 2,
+                'reach_total': reach
+            })
+        return items
+
+    def stats_get(self, arguments):
+        group_id = arguments.get(VK_MESSAGE_KEY.GROUPD_ID)
+        return [{
+            'sex': [
+                {'value': 'm', 'visitors': self._grow(('male', group_id), 100)},
+                {'value': 'f', 'visitors': self._grow(('female', group_id), 100)}
+            ]
+        }]
+
+    def groups_get(self, arguments):
+        user_id = int(arguments.get('user_id') or 0)
+        offset = int(arguments.get('offset') or 0)
+        count = int(arguments.get('count') or 1000)
+
+        items = [
+            {
+                VK_MESSAGE_KEY.ID: user_id * 10000 + index,
+                'name': 'Group {}'.format(user_id * 10000 + index),
+                'members_count': 10000 + index,
+                'is_closed': 0,
+                'photo_50': '',
+                'is_admin': 1,
+                'admin_level': 3
+            } for index in range(offset, min(offset + count, self.groups_per_user))
+        ]
+        return {VK_MESSAGE_KEY.COUNT: self.groups_per_user, VK_MESSAGE_KEY.ITEMS: items}
+
+
+def create_app(api: FakeVkApi) -> web.Application:
+    app = web.Application()
+    app['api'] = api
+    app.router.add_route('*', '/method/{method}', api.handle)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in VK API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per HTTP request')
+    parser.add_argument('--rate-limit', type=int, default=None, help='requests per second per token')
+    parser.add_argument('--execute-error-rate', type=float, default=0.0)
+    parser.add_argument('--access-denied-rate', type=float, default=0.0)
+    parser.add_argument('--too-many-requests-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    api = FakeVkApi(
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+        execute_error_rate=args.execute_error_rate,
+        access_denied_rate=args.access_denied_rate,
+        too_many_requests_rate=args.too_many_requests_rate,
+        seed=args.seed
+    )
+    web.run_app(create_app(api), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import time
+from collections import Counter
+
+import aiohttp
+
+from application import settings
+from platforms.vk import logger
+
+try:
+    import orjson
+
+    def json_loads(data):
+        return orjson.loads(data)
+except ImportError:
+    try:
+        import ujson
+
+        def json_loads(data):
+            return ujson.loads(data)
+    except ImportError:
+        json_loads = json.loads
+
+VK_API_URL = getattr(settings, 'VK_API_URL', 'https://api.vk.com/method/')
+VK_POOLED_HTTP = getattr(settings, 'VK_POOLED_HTTP', False)
+VK_HTTP_CONNECTIONS = getattr(settings, 'VK_HTTP_CONNECTIONS', 100)
+VK_HTTP_CONNECTIONS_PER_HOST = getattr(settings, 'VK_HTTP_CONNECTIONS_PER_HOST', 30)
+VK_HTTP_KEEPALIVE = getattr(settings, 'VK_HTTP_KEEPALIVE', 60)
+VK_HTTP_DNS_TTL = getattr(settings, 'VK_HTTP_DNS_TTL', 300)
+VK_HTTP_TIMEOUT = getattr(settings, 'VK_HTTP_TIMEOUT', 30)
+
+
+def decode_json(body: bytes):
+    """
+    Decodes a response body with the fastest available parser. Errors are
+    raised as json.JSONDecodeError with the body text in `doc`, as the
+    shared Sender does.
+    """
+    try:
+        return json_loads(body)
+    except ValueError as e:
+        doc = body.decode('utf-8', errors='replace') if isinstance(body, bytes) else body
+        raise json.JSONDecodeError(str(e), doc, 0)
+
+
+class VkHttpClient:
+    """
+    Per-worker HTTP client with one keep-alive connection pool: the
+    session and its connector live as long as the worker, connections to
+    api.vk.com are reused between requests and DNS answers are cached.
+
+    `stats` counts requests, new and reused connections and the time
+    spent decoding bodies, for the benchmark runner.
+    """
+
+    def __init__(self, api_url=VK_API_URL, limit=VK_HTTP_CONNECTIONS,
+                 limit_per_host=VK_HTTP_CONNECTIONS_PER_HOST, keepalive_timeout=VK_HTTP_KEEPALIVE,
+                 dns_ttl=VK_HTTP_DNS_TTL, timeout=VK_HTTP_TIMEOUT):
+        self._api_url = api_url
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._dns_ttl = dns_ttl
+        self._timeout = timeout
+        self._session = None
+        self._lock = None
+        self.stats = Counter()
+
+    async def session(self) -> aiohttp.ClientSession:
+        if self._session is not None and not self._session.closed:
+            return self._session
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if self._session is None or self._session.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=self._limit,
+                    limit_per_host=self._limit_per_host,
+                    keepalive_timeout=self._keepalive_timeout,
+                    ttl_dns_cache=self._dns_ttl,
+                    use_dns_cache=True
+                )
+                self._session = aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=aiohttp.ClientTimeout(total=self._timeout),
+                    trace_configs=[self._trace_config()]
+                )
+        return self._session
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        async def on_connection_create_end(session, context, params):
+            self.stats['connections_created'] += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            self.stats['connections_reused'] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    async def request(self, http_method, url, params=None, data=None):
+        session = await self.session()
+        async with session.request(http_method.upper(), url, params=params, data=data) as response:
+            body = await response.read()
+
+        self.stats['requests'] += 1
+        started_at = time.perf_counter()
+        try:
+            return decode_json(body)
+        finally:
+            self.stats['parse_seconds'] += time.perf_counter() - started_at
+
+    async def get(self, url, params=None):
+        return await self.request('get', url, params=params)
+
+    async def call_method(self, method):
+        """
+        Sends a BaseVkClient method through the pool. The query is built by
+        BaseVkClient.get_arguments(), the hook WallPostMethod overrides to
+        serialize its attachments, so method-specific encoding is kept.
+
+        As method.execute(), returns an empty dict when the request or
+        the decoding of its body fails.
+        """
+        arguments = dict(method.get_arguments())
+        arguments.setdefault('v', method.API_VERSION)
+        url = self._api_url + method.METHOD
+
+        try:
+            if method.HTTP_METHOD == 'post':
+                return await self.request('post', url, data=arguments)
+            return await self.request('get', url, params=arguments)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self.stats['errors'] += 1
+            logger.error('VK {} request failed: {!r}'.format(method.METHOD, e))
+            return {}
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+vk_http = VkHttpClient()
@@ -5,43 +5,39 @@ from platforms.utils.error.error import DefaultError
 from platforms.utils.error.error_code import ErrorCode
 
 from platforms.vk import sentry_logger
+from platforms.vk.credentials import (
+    AUTH_PROVIDER,
+    credentials_cache,
+    is_auth_error
+)
+from platforms.vk.reporting import entity_extra
 
 
 class VKBasePlatform(BasePlatform):
     PREFIX = 'vk'
-    AUTH_PROVIDER = 'vk-oauth2'
+    AUTH_PROVIDER = AUTH_PROVIDER
 
     @staticmethod
     def _get_vk_credentials(user: User):
-        social_auth = user.social_auth.get(provider=VKBasePlatform.AUTH_PROVIDER)
-        access_token = social_auth.extra_data['access_token']
-        social_uid = social_auth.uid
+        return credentials_cache.get(user.pk)
 
-        return social_uid, access_token
+    @staticmethod
+    def _get_vk_credentials_by_id(user_id):
+        return credentials_cache.get(user_id)
+
+    @staticmethod
+    def _prefetch_vk_credentials(user_ids):
+        credentials_cache.prefetch(user_ids)
 
     def log_to_sentry(self, entity, error, level='error'):
+        # только уже загруженные связи, без запросов к БД на каждую ошибку
+        extra = entity_extra(entity)
+        extra.update(error=error, video_id=entity.pk)
+
         if level == 'warning':
-            sentry_logger.warning(msg=error, extra={
-                'error': error,
-                'video_id': entity.pk,
-                'campaign_name': entity.campaign.name,
-                'campaign_id': entity.campaign_id,
-                'group_id': entity.group_id,
-                'groupname': entity.group.name,
-                'username': entity.user.get_full_name(),
-                'user_id': entity.user_id
-            })
+            sentry_logger.warning(msg=error, extra=extra)
         else:
-            sentry_logger.error(msg=error, extra={
-                'error': error,
-                'video_id': entity.pk,
-                'campaign_name': entity.campaign.name,
-                'campaign_id': entity.campaign_id,
-                'group_id': entity.group_id,
-                'groupname': entity.group.name,
-                'username': entity.user.get_full_name(),
-                'user_id': entity.user_id
-            })
+            sentry_logger.error(msg=error, extra=extra)
 
     def check_response(self, entity, response_dict, fail_status, delete_status=None) -> bool:
         if not response_dict:
@@ -58,6 +54,9 @@ class VKBasePlatform(BasePlatform):
 
         if VK_MESSAGE_KEY.ERROR in response_dict:
             error_dict = response_dict.get(VK_MESSAGE_KEY.ERROR)
+            if is_auth_error(error_dict):
+                credentials_cache.invalidate(entity.user_id)
+
             error = DefaultError.get_error_from_response(
                 error_dict=error_dict,
                 error_key=VK_MESSAGE_KEY.ERROR_MSG
@@ -1,18 +1,22 @@
 import json
 
 from core.models import User, Video
-from platforms.utils import (
-    split_list,
-    VK_MESSAGE_KEY
-)
+from platforms.utils import VK_MESSAGE_KEY
 from platforms.utils.error.error import DefaultError
 from platforms.utils.error.error_code import ErrorCode
 from platforms.vk import (
     logger,
     sentry_logger
 )
+from platforms.vk.changes import StatusCollector
+from platforms.vk.db import run_db
+from platforms.vk.execute_batcher import (
+    execute_batcher,
+    failed_responses
+)
 from platforms.vk.methods import VKBasePlatform
 from platforms.vk.methods.vk_methods.execute import ExecuteMethod
+from platforms.vk.reporting import ErrorReporter
 from social_services.message import BulkDeleteVideoTaskMessage
 from utils import get_object_or_none
 
@@ -20,106 +24,81 @@ from utils import get_object_or_none
 class BulkDeleteVideos(VKBasePlatform):
 
     async def bulk_delete_video(self, task_message: BulkDeleteVideoTaskMessage) -> bool:
-        user = get_object_or_none(User, pk=task_message.user_id)
+        user = await run_db(get_object_or_none, User, pk=task_message.user_id)
         if not user:
             logger.error('User not found {}'.format(task_message.user_id))
             return False
 
-        social_uid, access_token = self._get_vk_credentials(user)
-        videos_queryset = Video.objects.filter(pk__in=task_message.video_ids)
-        video_list = list(videos_queryset)
-        call_method_list = []
-
-        video_splits = split_list(video_list, 25)
-
-        for video_split in video_splits:
-            for video in video_split:
-                args = {
-                    VK_MESSAGE_KEY.OWNER_ID: video.owner,
-                    VK_MESSAGE_KEY.VIDEO_ID: video.vid
-                }
-                call = ExecuteMethod.construct(
-                    ExecuteMethod.VIDEO_ENTITY,
-                    ExecuteMethod.DELETE_METHOD,
-                    json.dumps(args)
-                )
-                call_method_list.append(call)
-
-            method = ExecuteMethod(
-                priority=task_message.priority,
-                access_token=access_token,
-                code=ExecuteMethod.construct_code(call_method_list)
+        social_uid, access_token = await run_db(self._get_vk_credentials, user)
+        video_list = await run_db(list, Video.objects.filter(pk__in=task_message.video_ids).select_related('group', 'campaign', 'user'))
+
+        items = []
+        for video in video_list:
+            args = {
+                VK_MESSAGE_KEY.OWNER_ID: video.owner,
+                VK_MESSAGE_KEY.VIDEO_ID: video.vid
+            }
+            call = ExecuteMethod.construct(
+                ExecuteMethod.VIDEO_ENTITY,
+                ExecuteMethod.DELETE_METHOD,
+                json.dumps(args)
             )
-
-            response_dict = await method.execute()
-
-            if not response_dict:
-                error = DefaultError(
-                    error_key=ErrorCode.RESPONSE_IS_EMPTY_KEY,
-                    text=ErrorCode.RESPONSE_IS_EMPTY_TEXT
-                )
-                for video in video_list:
-                    video.vk_response = error.to_json()
-                    video.status = Video.DELETE_FAIL
-                    video.save()
-                return False
-
-            if VK_MESSAGE_KEY.ERROR in response_dict:
-                error_dict = response_dict.get(VK_MESSAGE_KEY.ERROR)
-                error_msg = DefaultError.get_error_from_response(
-                    error_dict=error_dict,
-                    error_key=VK_MESSAGE_KEY.ERROR_CODE
+            items.append((access_token, call, video))
+
+        results = await execute_batcher.run(items, priority=task_message.priority)
+
+        return await run_db(self._process_delete_video_results, user, results)
+
+    def _process_delete_video_results(self, user, results) -> bool:
+        for response_dict in failed_responses(results):
+            sentry_logger.warning(msg="Error while deleting videos", extra={
+                'error': response_dict,
+                'user_id': user.pk,
+                'username': user.get_full_name()
+            })
+
+        statuses = StatusCollector(Video)
+        errors = ErrorReporter('bulk_delete_video')
+        is_request_failed = False
+        for result in results:
+            video = result.entity
+
+            if result.is_request_failed:
+                is_request_failed = True
+                if not result.response_dict:
+                    error_msg = DefaultError(
+                        error_key=ErrorCode.RESPONSE_IS_EMPTY_KEY,
+                        text=ErrorCode.RESPONSE_IS_EMPTY_TEXT
+                    ).to_json()
+                else:
+                    error_msg = DefaultError.get_error_from_response(
+                        error_dict=result.error,
+                        error_key=VK_MESSAGE_KEY.ERROR_CODE
+                    )
+                statuses.set(video, Video.DELETE_FAIL, vk_response=error_msg)
+                continue
+
+            if result.is_failed:
+                concrete_error = result.error or {}
+                concrete_error_msg = DefaultError.get_error_from_response(
+                    error_dict=concrete_error,
+                    error_key=VK_MESSAGE_KEY.ERROR_MSG
                 )
 
-                sentry_logger.warning(msg="Error while deleting videos", extra={
-                    'error': response_dict,
-                    'error_msg': error_msg,
-                    'user_id': user.pk,
-                    'username': user.get_full_name()
-                })
-
-                for video in video_list:
-                    video.vk_response = error_msg
-                    video.status = Video.DELETE_FAIL
-                    video.save()
-
-                return False
-
-            response_list = response_dict.get(VK_MESSAGE_KEY.RESPONSE)
-            if VK_MESSAGE_KEY.EXECUTE_ERRORS in response_dict:
-                error_list = response_dict.get(VK_MESSAGE_KEY.EXECUTE_ERRORS)
-                false_response_videos = []
-
-                # порядок постов в сплите совпадает с порядком постов в ответе
-                for index, video in enumerate(video_split):
-                    if not response_list[index]:
-                        false_response_videos.append(video)
-
-                if false_response_videos:
-                    for index, video in enumerate(false_response_videos):
-                        concrete_error = error_list[index]
-                        concrete_error_msg = DefaultError.get_error_from_response(
-                            error_dict=concrete_error,
-                            error_key=VK_MESSAGE_KEY.ERROR_MSG
-                        )
-
-                        # error code 7, Access denied распознаем, как удаленные
-                        error_message = concrete_error.get(VK_MESSAGE_KEY.ERROR_MSG)
-                        if error_message == ErrorCode.ACCESS_DENIED_KEY:
-                            video.status = Video.IS_DELETED
-                        else:
-                            video.status = Video.DELETE_FAIL
-
-                        video.vk_response = concrete_error_msg
-
-                        video.save()
-                        self.log_to_sentry(video, concrete_error_msg, level='warning')
+                # error code 7, Access denied распознаем, как удаленные
+                error_message = concrete_error.get(VK_MESSAGE_KEY.ERROR_MSG)
+                if error_message == ErrorCode.ACCESS_DENIED_KEY:
+                    status = Video.IS_DELETED
+                else:
+                    status = Video.DELETE_FAIL
+
+                statuses.set(video, status, vk_response=concrete_error_msg)
+                errors.add(video, concrete_error_msg, level='warning', key=concrete_error.get(VK_MESSAGE_KEY.ERROR_CODE))
+            elif result.response:
+                statuses.set(video, Video.IS_DELETED)
             else:
-                for index, video in enumerate(video_split):
-                    if response_list[index]:
-                        video.status = Video.IS_DELETED
-                        video.save()
-            call_method_list[:] = []
+                statuses.set(video, Video.DELETE_FAIL)
 
-        videos_queryset.update(status=Video.IS_DELETED)
-        return True
+        statuses.flush()
+        errors.flush()
+        return not is_request_failed
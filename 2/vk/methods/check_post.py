@@ -1,8 +1,9 @@
 from core.models import Post
 from platforms.utils import VK_MESSAGE_KEY
 from platforms.vk import sentry_logger
+from platforms.vk.db import run_db
 from platforms.vk.methods import VKBasePlatform
-from platforms.vk.methods.vk_methods.wall import WallGetByIdMethod
+from platforms.vk.snapshots import post_snapshots
 from social_services.message import (
     VkCheckPostMessage,
     SocialType
@@ -13,23 +14,30 @@ from social_services.social_service import SocialService
 class CheckPost(VKBasePlatform):
 
     async def check_post(self, task_message: VkCheckPostMessage):
-        post = Post.objects.get(pk=task_message.post_id)
-        user = post.user
-        social_uid, access_token = self._get_vk_credentials(user)
-
-        result = await self._wall_get_by_id(
-            post=post,
-            priority=task_message.priority,
-            access_token=access_token
+        post = await run_db(Post.objects.select_related('user', 'group').get, pk=task_message.post_id)
+        social_uid, access_token = await run_db(self._get_vk_credentials, post.user)
+
+        snapshots, failed = await post_snapshots.fetch(
+            access_token,
+            post.group.group_id,
+            [post],
+            priority=task_message.priority
         )
-        response = result.get(VK_MESSAGE_KEY.RESPONSE)
 
-        if not response:
+        if failed:
+            sentry_logger.warning(msg={
+                'error': failed[0].error or failed[0].response_dict
+            })
+            return False
+
+        response_item = snapshots[post.post_id]
+
+        if response_item is None:
             post.status = Post.DELETED_BY_VK
-            post.save()
+            await run_db(post.save)
             return True
 
-        if VK_MESSAGE_KEY.ATTACHMENT not in response[0]:
+        if VK_MESSAGE_KEY.ATTACHMENT not in response_item:
             sentry_logger.error(msg={
                 'post_pk': post.pk,
                 'message': 'Нет видео у поста'
@@ -37,14 +45,3 @@ class CheckPost(VKBasePlatform):
             SocialService.delete_post(SocialType.VK, post_id=post.pk, delete_status=Post.WITHOUT_VIDEO)
 
         return True
-
-    async def _wall_get_by_id(self, post, priority, access_token):
-        post_string = "-{}_{}".format(post.group.group_id, post.post_id)
-
-        method = WallGetByIdMethod(
-            access_token=access_token,
-            posts=post_string,
-            priority=priority
-        )
-
-        return await method.execute()
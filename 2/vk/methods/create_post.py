@@ -17,9 +17,11 @@ from platforms.utils import (
 from platforms.utils.error.error import DefaultError
 from platforms.utils.error.error_code import ErrorCode
 from platforms.vk import logger
+from platforms.vk.db import run_db
 from platforms.vk.methods import VKBasePlatform
 from platforms.vk.methods.vk_methods.video import VideoSaveMethod
 from platforms.vk.methods.vk_methods.wall import WallPostMethod
+from platforms.vk.resilience import call_with_retry
 from social_services.message import (
     PostTaskMessage,
     TargetVideoUpload
@@ -32,22 +34,16 @@ class CreatePost(VKBasePlatform):
 
     @time_result
     async def create_post(self, task_message: PostTaskMessage) -> bool:
-        post = get_object_or_none(Post, pk=task_message.post_id)
-        if not post:
+        loaded = await run_db(self._load_create_post, task_message)
+        if not loaded:
             logger.error('Post Not Found Post id {}'.format(task_message.post_id))
             return False
 
-        user = User.objects.get(pk=task_message.user_id)
-        group = Group.objects.get(pk=task_message.target_group_id)
-        campaign = AdvertisingCampaign.objects.get(pk=task_message.campaign_id)
+        post, user, group, campaign, video, access_token = loaded
 
         description = task_message.text
         target_video_upload = task_message.target_video_upload
 
-        social_uid, access_token = self._get_vk_credentials(user=user)
-
-        video = Video.objects.filter(group=group, campaign=campaign, user=user, status=Video.IS_ACTIVE).first()
-
         if not video:
             video = Video(
                 group=group,
@@ -56,7 +52,7 @@ class CreatePost(VKBasePlatform):
                 status=Video.IN_PROGRESS,
                 factor=settings.KOFF
             )
-            video.save()
+            await run_db(video.save)
 
             to_group = target_video_upload == TargetVideoUpload.GROUP.value
             status_ok = await self._video_save(
@@ -73,7 +69,7 @@ class CreatePost(VKBasePlatform):
             if not status_ok:
                 post.status = Post.FAILED
                 post.vk_response = video.vk_response
-                post.save()
+                await run_db(post.save)
                 return False
 
             if status_ok == VideoSaveMethod.TOO_MUCH_REQUESTS_MSG:
@@ -89,6 +85,21 @@ class CreatePost(VKBasePlatform):
             campaign_pk=campaign.pk
         )
 
+    def _load_create_post(self, task_message: PostTaskMessage):
+        post = get_object_or_none(Post, pk=task_message.post_id)
+        if not post:
+            return None
+
+        user = User.objects.get(pk=task_message.user_id)
+        group = Group.objects.get(pk=task_message.target_group_id)
+        campaign = AdvertisingCampaign.objects.get(pk=task_message.campaign_id)
+
+        social_uid, access_token = self._get_vk_credentials(user=user)
+
+        video = Video.objects.filter(group=group, campaign=campaign, user=user, status=Video.IS_ACTIVE).first()
+
+        return post, user, group, campaign, video, access_token
+
     async def _wall_post(self, access_token, group, video, priority, description, post, campaign_pk):
         method = WallPostMethod(
             access_token=access_token,
@@ -104,7 +115,8 @@ class CreatePost(VKBasePlatform):
 
         response_dict = await method.execute()
 
-        if not self.check_response(
+        if not await run_db(
+                self.check_response,
                 post,
                 response_dict,
                 fail_status=Post.FAILED,
@@ -115,6 +127,9 @@ class CreatePost(VKBasePlatform):
         response = response_dict.get(VK_MESSAGE_KEY.RESPONSE)
         post.status = Post.IS_ACTIVE
         post.post_id = response.get(VK_MESSAGE_KEY.POST_ID)
+        return await run_db(self._finish_wall_post, post, campaign_pk)
+
+    def _finish_wall_post(self, post, campaign_pk):
         post.save()
 
         post_screen_exists = GroupPostImgs.objects.filter(
@@ -148,14 +163,19 @@ class CreatePost(VKBasePlatform):
 
         response_dict = await method.execute()
 
-        if not self.check_response(video, response_dict, Video.UPLOAD_FAIL):
+        if not await run_db(self.check_response, video, response_dict, Video.UPLOAD_FAIL):
             return False
 
         response = response_dict.get(VK_MESSAGE_KEY.RESPONSE)
 
         upload_url = response.get(VK_MESSAGE_KEY.UPLOAD_URL)
 
-        toggle_ok = await VideoSaveMethod.toggle_upload_link(upload_url=upload_url)
+        # при перегрузке ВК повторяем внутри задачи, а не через брокер
+        toggle_ok = await call_with_retry(
+            lambda: VideoSaveMethod.toggle_upload_link(upload_url=upload_url),
+            key=VideoSaveMethod.UPLOAD_BREAKER_KEY,
+            is_retryable=VideoSaveMethod.is_toggle_retryable
+        )
 
         if toggle_ok and toggle_ok == VideoSaveMethod.TOO_MUCH_REQUESTS_MSG:
             SocialService.toggle_upload_link(
@@ -177,7 +197,7 @@ class CreatePost(VKBasePlatform):
 
             video.status = Video.UPLOAD_FAIL
             video.vk_response = video_error.to_json()
-            video.save()
+            await run_db(video.save)
             return False
 
         if not toggle_ok:
@@ -186,14 +206,14 @@ class CreatePost(VKBasePlatform):
                 text=ErrorCode.VIDEO_UPLOAD_CHECK_TEXT,
                 error_code=1100
             )
-            self.log_to_sentry(video, video_error.to_json())
+            await run_db(self.log_to_sentry, video, video_error.to_json())
             video.status = Video.UPLOAD_FAIL
             video.vk_response = video_error.to_json()
-            video.save()
+            await run_db(video.save)
             return False
         else:
             video.status = Video.IS_ACTIVE
             video.vid = response.get(VK_MESSAGE_KEY.VIDEO_ID)
             video.owner = response.get(VK_MESSAGE_KEY.OWNER_ID)
-            video.save()
+            await run_db(video.save)
             return True
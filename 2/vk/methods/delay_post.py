@@ -3,6 +3,7 @@ from core.models.vk import (
     DelayedPost,
     Post
 )
+from platforms.vk.db import run_db
 from platforms.vk.methods.create_post import CreatePost
 from platforms.vk.methods.repost import Repost
 from platforms.vk.methods.video_post import VideoPost
@@ -19,8 +20,7 @@ from social_services.task_priorities import TaskPriority
 class DelayPost(Repost, CreatePost, VideoPost):
 
     async def delay_post(self, task_message: DelayedPostTaskMessage) -> bool:
-        delay_obj = DelayedPost.objects.get(pk=task_message.delay_pk)
-        campaign = AdvertisingCampaign.objects.get(pk=task_message.campaign_id)
+        delay_obj, campaign = await run_db(self._load_delayed_post, task_message)
 
         if delay_obj.status == DelayedPost.IDLE:
             if delay_obj.post.campaign.is_active:
@@ -71,12 +71,22 @@ class DelayPost(Repost, CreatePost, VideoPost):
                     create_status = await func(new_task_message)
                     if create_status:
                         delay_obj.status = DelayedPost.SUCCESS
-                        delay_obj.save()
+                        await run_db(delay_obj.save)
                     else:
-                        post = Post.objects.get(pk=delay_obj.post_id)
-                        post.status = Post.FAILED
-                        post.save()
-                        delay_obj.status = DelayedPost.FAILED
-                        delay_obj.save()
+                        await run_db(self._fail_delayed_post, delay_obj)
 
         return True
+
+    @staticmethod
+    def _load_delayed_post(task_message: DelayedPostTaskMessage):
+        delay_obj = DelayedPost.objects.select_related('post__campaign').get(pk=task_message.delay_pk)
+        campaign = AdvertisingCampaign.objects.get(pk=task_message.campaign_id)
+        return delay_obj, campaign
+
+    @staticmethod
+    def _fail_delayed_post(delay_obj):
+        post = Post.objects.get(pk=delay_obj.post_id)
+        post.status = Post.FAILED
+        post.save()
+        delay_obj.status = DelayedPost.FAILED
+        delay_obj.save()
@@ -1,22 +1,22 @@
 from core.models import Post
 from platforms.utils import format_group_id
 from platforms.vk import logger
+from platforms.vk.db import run_db
 from platforms.vk.methods import VKBasePlatform
 from platforms.vk.methods.vk_methods.wall import WallDeleteMethod
 from social_services.message import DeletePostTaskMessage
-from utils import get_object_or_none
 
 
 class DeletePost(VKBasePlatform):
 
     async def delete_post(self, task_message: DeletePostTaskMessage) -> bool:
-        post = get_object_or_none(Post, pk=task_message.post_id)
+        post = await run_db(Post.objects.select_related('user', 'group').filter(pk=task_message.post_id).first)
 
         if not post:
             logger.error('Post Not Found Post id {}'.format(task_message.post_id))
             return False
 
-        social_uid, access_token = self._get_vk_credentials(post.user)
+        social_uid, access_token = await run_db(self._get_vk_credentials, post.user)
 
         method = WallDeleteMethod(
             priority=task_message.priority,
@@ -27,7 +27,8 @@ class DeletePost(VKBasePlatform):
 
         response_dict = await method.execute()
 
-        status = self.check_response(
+        status = await run_db(
+            self.check_response,
             post,
             response_dict,
             fail_status=Post.FAILED_DELETE,
@@ -38,5 +39,5 @@ class DeletePost(VKBasePlatform):
             return False
 
         post.status = Post.IS_DELETED if task_message.delete_status == Post.IS_DELETED else task_message.delete_status
-        post.save()
+        await run_db(post.save)
         return True
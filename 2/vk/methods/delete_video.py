@@ -1,20 +1,20 @@
 from core.models import Video
 from platforms.vk import logger
+from platforms.vk.db import run_db
 from platforms.vk.methods import VKBasePlatform
 from platforms.vk.methods.vk_methods.video import VideoDeleteMethod
 from social_services.message import DeleteVideoTaskMessage
-from utils import get_object_or_none
 
 
 class DeleteVideo(VKBasePlatform):
 
     async def delete_video(self, task_message: DeleteVideoTaskMessage) -> bool:
-        video = get_object_or_none(Video, pk=task_message.video_id)
+        video = await run_db(Video.objects.select_related('user').filter(pk=task_message.video_id).first)
         if not video:
             logger.error('Video Not Found vid: {}'.format(task_message.video_id))
             return False
 
-        social_uid, access_token = self._get_vk_credentials(video.user)
+        social_uid, access_token = await run_db(self._get_vk_credentials, video.user)
 
         method = VideoDeleteMethod(
             access_token=access_token,
@@ -25,7 +25,8 @@ class DeleteVideo(VKBasePlatform):
 
         response_dict = await method.execute()
 
-        status = self.check_response(
+        status = await run_db(
+            self.check_response,
             video,
             response_dict,
             fail_status=Video.DELETE_FAIL,
@@ -36,5 +37,5 @@ class DeleteVideo(VKBasePlatform):
             return False
 
         video.status = Video.IS_DELETED
-        video.save()
+        await run_db(video.save)
         return True
@@ -1,26 +1,27 @@
+import asyncio
 import json
 import traceback
 from datetime import datetime
 
-from django.db.models import Prefetch
 from django.utils import timezone
 
 from core.models import (
     AdvertisingCampaign,
     Group, UserGroup,
-    User,
     Post,
     PostStats
 )
-from core.models.vk import UnitedPostsStat
-from platforms.utils import (
-    VK_MESSAGE_KEY,
-    split_list
-)
+from platforms.utils import VK_MESSAGE_KEY
 from platforms.vk import (
     logger,
     sentry_logger
 )
+from platforms.vk.changes import (
+    ensure_post_stats,
+    ensure_united_posts_stats
+)
+from platforms.vk.db import run_db
+from platforms.vk.execute_batcher import execute_batcher
 from platforms.vk.methods import VKBasePlatform
 from platforms.vk.methods.vk_methods.execute import ExecuteMethod
 from social_services.message import GetStatsGroupMessage
@@ -29,133 +30,137 @@ from social_services.message import GetStatsGroupMessage
 class GetStatsGroup(VKBasePlatform):
 
     async def get_stats_group(self, task_message: GetStatsGroupMessage):
-        campaign = AdvertisingCampaign.objects.get(pk=task_message.campaign_id)
-        groups = Group.objects.filter(pk__in=task_message.group_ids)
-        user_groups_queryset = UserGroup.objects.filter(group_id__in=task_message.group_ids)
-
-        prefetch = Prefetch(
-            'user_groups_m2m',
-            queryset=user_groups_queryset,
-            to_attr='custom_user_groups'
-        )
-
-        users = User.objects.filter(pk__in=user_groups_queryset.values_list('user_id', flat=True).distinct()) \
-            .prefetch_related(prefetch)
-
-        if not groups:
+        loaded = await run_db(self._load_stats_group, task_message.campaign_id, task_message.group_ids)
+        if not loaded:
             logger.error('Groups is empty {}'.format(task_message.group_ids))
             return False
+
+        campaign, groups = loaded
         try:
+            date_from = campaign.date_created.strftime('%Y-%m-%d')
             date_to = datetime.now().strftime('%Y-%m-%d')
 
-            for user in users:
-                token = self._get_vk_credentials(user)[1]
-                user_groups = user.custom_user_groups
-                execute_calls = []
-
-                for user_group in user_groups:
-                    execute_calls.append(ExecuteMethod.construct(
-                        ExecuteMethod.STATS_ENTITY,
-                        ExecuteMethod.GET_METHOD,
-                        json.dumps({
-                            VK_MESSAGE_KEY.GROUPD_ID: user_group.group.group_id,
-                            VK_MESSAGE_KEY.DATE_FROM: campaign.date_created.strftime('%Y-%m-%d'),
-                            VK_MESSAGE_KEY.DATE_TO: date_to
-
-                        })
-                    ))
-                    user_group.group.is_stat_fetching = True
-                    user_group.group.save()
-
-                execute_parts = split_list(execute_calls, 25)
-                group_parts = split_list(user_groups, 25)
-
-                for index_part, execute_part in enumerate(execute_parts):
-                    group_part = group_parts[index_part]
-                    method = ExecuteMethod(
-                        priority=task_message.priority,
-                        access_token=token,
-                        code=ExecuteMethod.construct_code(execute_part)
-                    )
-                    response_dict = await method.execute()
-                    if not response_dict:
-                        traceback_log = traceback.format_exc()
-                        sentry_logger.error(msg="False response on get stat Group", extra={
-                            'trace': traceback_log,
-                            'locals': locals()
-                        })
-                        continue
-                    response_list = response_dict.get(VK_MESSAGE_KEY.RESPONSE)
-                    if VK_MESSAGE_KEY.ERROR in response_dict:
-                        sentry_error = {
-                            'error': response_dict
-                        }
-
-                        sentry_logger.warning(msg=sentry_error)
-                        continue
-
-                    for index, group_api_call in enumerate(execute_part):
-                        if response_list[index]:
-                            posts = Post.objects.all().filter(
-                                group=group_part[index].group,
-                                campaign__pk=task_message.campaign_id,
-                                status=Post.IS_ACTIVE
-                            )
-                            male, female = 0, 0
-
-                            for stat_item in response_list[index]:
-                                if 'sex' in stat_item:
-                                    m = list(filter(lambda sexes: 'm' in sexes.values(), stat_item['sex']))
-                                    if len(m) == 1:
-                                        male += int(m[0]['visitors'])
-
-                                    f = list(filter(lambda sexes: 'f' in sexes.values(), stat_item['sex']))
-                                    if len(f) == 1:
-                                        female += int(f[0]['visitors'])
-
-                            for post in posts:
-                                post_stats = PostStats.objects.get_or_create(post=post)[0]
-                                u_stat, _ = UnitedPostsStat.objects.get_or_create(
-                                    user=post.user,
-                                    group=post.group,
-                                    campaign=post.campaign
-                                )
-
-                                if not female and not male:
-                                    post_stats.sex_m = 0
-                                    post_stats.sex_f = 0
-                                else:
-                                    sex_m = round(male / (male + female) * 100, 1)
-                                    sex_f = round(female / (male + female) * 100, 1)
-                                    post_stats.sex_m = sex_m
-                                    post_stats.sex_f = sex_f
-                                post_stats.save()
-
-                        else:
-                            group = group_part[index].group
-                            sentry_error = {
-                                'error': response_dict.get(VK_MESSAGE_KEY.EXECUTE_ERRORS),
-                                'group': group.name
-                            }
-                            sentry_logger.warning(msg=sentry_error, extra={
-                                'response': response_dict,
-                                'execute_part': execute_part,
-                                'group_part': group_part,
-                                'execute_parts': execute_parts,
-                                'group_parts': group_parts
-                            })
+            # статистика каждого сообщества запрашивается один раз, сообщества - параллельно
+            results = await asyncio.gather(*(
+                self._fetch_group_stats(group, tokens, date_from, date_to, task_message.priority)
+                for group, tokens in groups
+            ))
+
+            await run_db(self._process_stats_group_results, task_message.campaign_id, results)
 
         except Exception as e:
             traceback_log = traceback.format_exc()
             sentry_logger.error(msg=e, extra={
                 'trace': traceback_log,
-                'locals': locals()
+                'campaign_id': task_message.campaign_id,
+                'group_ids': task_message.group_ids
             })
 
-        Group \
-            .objects \
-            .filter(pk__in=task_message.group_ids) \
-            .update(is_stat_fetching=False,
-                    last_stat_fetch_date=timezone.make_aware(datetime.now(), timezone.get_default_timezone()))
+        await run_db(
+            Group.objects.filter(pk__in=task_message.group_ids).update,
+            is_stat_fetching=False,
+            last_stat_fetch_date=timezone.make_aware(datetime.now(), timezone.get_default_timezone())
+        )
 
         return True
+
+    async def _fetch_group_stats(self, group, tokens, date_from, date_to, priority):
+        """Requests stats.get of the group, falling back to the next admin token on failure."""
+        call = ExecuteMethod.construct(
+            ExecuteMethod.STATS_ENTITY,
+            ExecuteMethod.GET_METHOD,
+            json.dumps({
+                VK_MESSAGE_KEY.GROUPD_ID: group.group_id,
+                VK_MESSAGE_KEY.DATE_FROM: date_from,
+                VK_MESSAGE_KEY.DATE_TO: date_to
+            })
+        )
+
+        result = None
+        for access_token in tokens:
+            result = await execute_batcher.call(access_token, call, group, priority)
+            if not result.is_failed:
+                break
+        return result
+
+    def _load_stats_group(self, campaign_id, group_ids):
+        campaign = AdvertisingCampaign.objects.get(pk=campaign_id)
+        groups = list(Group.objects.filter(pk__in=group_ids))
+        if not groups:
+            return None
+
+        admins = list(UserGroup.objects.filter(group_id__in=group_ids).values_list('group_id', 'user_id'))
+        self._prefetch_vk_credentials(user_id for _, user_id in admins)
+
+        tokens_by_group = {}
+        for group_id, user_id in admins:
+            tokens = tokens_by_group.setdefault(group_id, [])
+            try:
+                access_token = self._get_vk_credentials_by_id(user_id)[1]
+            except Exception as e:
+                logger.error(e)
+                continue
+            if access_token not in tokens:
+                tokens.append(access_token)
+
+        Group.objects.filter(pk__in=group_ids).update(is_stat_fetching=True)
+
+        return campaign, [
+            (group, tokens_by_group[group.pk]) for group in groups if tokens_by_group.get(group.pk)
+        ]
+
+    def _process_stats_group_results(self, campaign_id, results):
+        sex_by_group = {}
+
+        for result in results:
+            group = result.entity
+            if result.is_failed or not result.response:
+                if not result.response_dict:
+                    sentry_logger.error(msg="False response on get stat Group")
+                sentry_logger.warning(msg={
+                    'error': result.error or result.response_dict,
+                    'group': group.name
+                }, extra={
+                    'response': result.response_dict
+                })
+                continue
+
+            male, female = 0, 0
+
+            for stat_item in result.response:
+                if 'sex' in stat_item:
+                    m = list(filter(lambda sexes: 'm' in sexes.values(), stat_item['sex']))
+                    if len(m) == 1:
+                        male += int(m[0]['visitors'])
+
+                    f = list(filter(lambda sexes: 'f' in sexes.values(), stat_item['sex']))
+                    if len(f) == 1:
+                        female += int(f[0]['visitors'])
+
+            if not female and not male:
+                sex_by_group[group.pk] = 0, 0
+            else:
+                sex_by_group[group.pk] = (
+                    round(male / (male + female) * 100, 1),
+                    round(female / (male + female) * 100, 1)
+                )
+
+        if not sex_by_group:
+            return
+
+        posts = list(Post.objects.filter(
+            group_id__in=list(sex_by_group),
+            campaign__pk=campaign_id,
+            status=Post.IS_ACTIVE
+        ).only('pk', 'user_id', 'group_id', 'campaign_id'))
+
+        ensure_post_stats(post.pk for post in posts)
+        ensure_united_posts_stats(posts)
+
+        # одно соотношение на сообщество - один UPDATE на все его посты
+        for group_id, (sex_m, sex_f) in sex_by_group.items():
+            PostStats.objects.filter(
+                post__group_id=group_id,
+                post__campaign__pk=campaign_id,
+                post__status=Post.IS_ACTIVE
+            ).update(sex_m=sex_m, sex_f=sex_f)
@@ -1,200 +1,290 @@
+import bisect
 import json
 import traceback
+from collections import defaultdict
 from datetime import datetime
 
-from django.db.models import Prefetch
 from django.utils import timezone
-from transliterate import translit
 
-from application.settings import StatsClient
+from application import settings
 from core.models import (
     Post,
-    User,
-    PostStats,
     AdvertisingCampaign
 )
-from core.models.stats import ViewsStat
-from core.models.vk import (
-    UnitedPostsStat,
-    SuspiciousUser
-)
 from platforms.utils import (
+    split_list,
     VK_MESSAGE_KEY,
-    format_group_id,
-    split_list
+    format_group_id
 )
 from platforms.vk import (
     logger,
     sentry_logger
 )
+from platforms.vk.changes import (
+    PostStatsUpserter,
+    ViewsStatAggregator,
+    ensure_united_posts_stats
+)
+from platforms.vk.checkpoint import JobCheckpoint
+from platforms.vk.db import run_db
+from platforms.vk.execute_batcher import (
+    ExecuteResult,
+    execute_batcher,
+    failed_responses,
+    split_by_request
+)
 from platforms.vk.methods import VKBasePlatform
 from platforms.vk.methods.vk_methods.execute import ExecuteMethod
+from platforms.vk.metrics import SuspiciousUsersReporter
+from platforms.vk.refresh import (
+    RefreshScheduler,
+    refresh_scheduler
+)
+from platforms.vk.reporting import ErrorReporter
 from social_services.message import (
     GetStatsPostMessage,
     SocialType
 )
 from social_services.social_service import SocialService
 
+POST_IDS_KEY = 'post_ids'
+# stats.getPostReach принимает не больше 30 постов за вызов
+POST_REACH_CHUNK_SIZE = 30
+VK_STATS_CHUNK_SIZE = getattr(settings, 'VK_STATS_CHUNK_SIZE', 5000)
+
+
+def split_post_reach(results) -> list:
+    """
+    Splits results of multi-post `stats.getPostReach` calls (entity is a
+    chunk of posts) into one result per post, matched by `post_id`.
+    """
+    post_results = []
+    for result in results:
+        if result.is_failed:
+            post_results.extend(
+                ExecuteResult(post, result.response, result.error, result.response_dict)
+                for post in result.entity
+            )
+            continue
+
+        reach_items = defaultdict(list)
+        for item in result.response:
+            reach_items[item.get(VK_MESSAGE_KEY.POST_ID)].append(item)
+
+        post_results.extend(
+            ExecuteResult(post, reach_items.get(post.post_id, []), None, result.response_dict)
+            for post in result.entity
+        )
+    return post_results
+
 
 class GetStatsPosts(VKBasePlatform):
 
     async def get_stats_post(self, task_message: GetStatsPostMessage):
-        posts_queryset = Post.objects.filter(pk__in=task_message.post_ids, group__members__gt=5000)
-        prefetch = Prefetch(
-            'posts',
-            queryset=posts_queryset,
-            to_attr='custom_prefetch_posts'
+        # посты, охват которых давно не меняется, опрашиваются реже
+        post_ids = await run_db(
+            refresh_scheduler.select,
+            RefreshScheduler.POST_REACH,
+            task_message.post_ids,
+            force=getattr(task_message, 'force_refresh', False)
         )
-        user_id_list = posts_queryset.values_list('user_id', flat=True).distinct()
-        users = User.objects.filter(pk__in=user_id_list).prefetch_related(prefetch)
-
-        try:
-            if not posts_queryset:
-                logger.error('Posts are empty {}'.format(task_message.post_ids))
-                return False
-
-            posts_queryset.update(is_stat_fetching=True)
-
-            for user in users:
-                posts = user.custom_prefetch_posts
-                social_uid, access_token = self._get_vk_credentials(user)
-                api_calls = [
-                    ExecuteMethod.construct(
-                        ExecuteMethod.STATS_ENTITY,
-                        ExecuteMethod.POST_REACH,
-                        json.dumps({
-                            VK_MESSAGE_KEY.OWNER_ID: format_group_id(post.group.group_id),
-                            VK_MESSAGE_KEY.POST_ID: post.post_id
-                        })
-                    ) for post in posts
-                ]
-
-                execute_parts = split_list(api_calls, 25)
-                posts_parts = split_list(posts, 25)
-
-                for index_part, execute_part in enumerate(execute_parts):
-                    post_part = posts_parts[index_part]
-                    method = ExecuteMethod(
-                        priority=task_message.priority,
-                        access_token=access_token,
-                        code=ExecuteMethod.construct_code(execute_part)
+        if not post_ids:
+            return True
+
+        checkpoint = JobCheckpoint('stats-post', task_message.post_ids)
+        after_pk = await run_db(checkpoint.load)
+        processed = 0
+
+        # посты читаются и сохраняются порциями, в памяти не больше одной порции;
+        # каждый запрос получает только id своей порции
+        post_ids = sorted(post_ids)
+        start = bisect.bisect_right(post_ids, after_pk)
+        for chunk_ids in split_list(post_ids[start:], VK_STATS_CHUNK_SIZE):
+            posts = await run_db(self._load_stats_chunk, chunk_ids)
+            try:
+                if posts:
+                    tokens = await run_db(self._load_stats_tokens, posts)
+                    await self._fetch_stats_chunk(posts, tokens, task_message.priority)
+            except Exception as e:
+                traceback_log = traceback.format_exc()
+                sentry_logger.error(msg=e, extra={
+                    'trace': traceback_log,
+                    'posts_count': len(post_ids),
+                    'chunk_first_pk': chunk_ids[0],
+                    'chunk_last_pk': chunk_ids[-1]
+                })
+            finally:
+                if posts:
+                    await run_db(
+                        Post.objects.filter(pk__in=[post.pk for post in posts]).update,
+                        is_stat_fetching=False,
+                        last_stat_fetch_date=timezone.make_aware(datetime.now(), timezone.get_default_timezone())
                     )
 
-                    response_dict = await method.execute()
-                    if not response_dict:
-                        traceback_log = traceback.format_exc()
-                        sentry_logger.error(msg="False response on get stat Post", extra={
-                            'trace': traceback_log,
-                            'locals': locals()
-                        })
-                        continue
-                    response_list = response_dict.get(VK_MESSAGE_KEY.RESPONSE)
-                    if VK_MESSAGE_KEY.ERROR in response_dict:
-                        sentry_error = {
-                            'error': response_dict
-                        }
-                        sentry_logger.warning(msg=sentry_error)
-                        continue
-
-                    if VK_MESSAGE_KEY.EXECUTE_ERRORS in response_dict:
-                        false_response_list = []
-
-                        for index, post_api_call in enumerate(execute_part):
-                            if not response_list[index]:
-                                post = post_part[index]
-                                false_response_list.append(post)
-
-                        errors = response_dict.get(VK_MESSAGE_KEY.EXECUTE_ERRORS)
-
-                        if errors and false_response_list:
-                            for index, post in enumerate(false_response_list):
-                                error = errors[index]
-                                post_stats, is_created = PostStats.objects.get_or_create(post=post)
-                                post_stats.vk_response = error
-                                post_stats.save()
-                                sentry_logger.warning(
-                                    msg='False response get_stat for post pk {}'.format(post.pk),
-                                    extra={
-                                        'post_id_in_vk': post.post_id,
-                                        'group': post.group.name,
-                                        'user_pk': post.user_id,
-                                        'username': post.user.get_full_name(),
-                                        'error': error,
-                                        'link': 'https://vk.com/wall-{}_{}'.format(
-                                            post.group.group_id,
-                                            post.post_id
-                                        )
-                                    }
-                                )
-                                SocialService.vk_check_post(SocialType.VK, post_id=post.pk)
-
-                    for index, post_api_call in enumerate(execute_part):
-                        if response_list[index]:
-                            posts_array = response_list[index]
-                            post = post_part[index]
-                            post_stats, is_created = PostStats.objects.get_or_create(post=post)
-
-                            u_stat, _ = UnitedPostsStat.objects.get_or_create(
-                                user=post.user,
-                                group=post.group,
-                                campaign=post.campaign
-                            )
-
-                            if 'reach_subscribers' in posts_array[0] and 'reach_total' in posts_array[0]:
-                                if post.campaign.campaign_type in [AdvertisingCampaign.VK_VIDEO_POST,
-                                                                   AdvertisingCampaign.VK_REPOST]:
-                                    last_views = int(
-                                        post_stats.reach.split('/')[1].replace('-', '0')) if post_stats.reach else 0
-                                    diff = posts_array[0]['reach_total'] - last_views
-                                    today = timezone.make_aware(
-                                        datetime.now(),
-                                        timezone.get_default_timezone()
-                                    ).date()
-
-                                    views_stat, _ = ViewsStat.objects.get_or_create(
-                                        group=post.group,
-                                        campaign=post.campaign,
-                                        date__contains=today,
-                                        user=post.user
-                                    )
-                                    if diff:
-                                        views_stat.views += diff
-                                        views_stat.save()
-
-                                post_stats.reach = '{}/{}'.format(
-                                    str(posts_array[0]['reach_subscribers']),
-                                    str(posts_array[0]['reach_total'])
-                                )
-                                post_stats.save()
-                            try:
-                                if len(SuspiciousUser.objects.filter(user=post.user, campaign=post.campaign)) > 0:
-                                    reach_tags = {
-                                        'type': 'reach',
-                                        'campaign_pk': post.campaign.pk,
-                                        'user_pk': post.user.pk,
-                                        'user': translit(str(post.user), 'ru', reversed=True),
-                                        'group_pk': post.group.pk,
-                                        'group_name': translit(post.group.name, 'ru', reversed=True)
-                                    }
-                                    StatsClient.event('video-seed__suspicious_users',
-                                                      value=posts_array[0]['reach_total'],
-                                                      tags=reach_tags)
-                            except Exception as e:
-                                sentry_logger.error(msg=e)
-
-                for post in posts:
-                    post.is_stat_fetching = False
-                    post.last_stat_fetch_date = timezone.make_aware(datetime.now(), timezone.get_default_timezone())
-                    post.save()
-
-        except Exception as e:
-            traceback_log = traceback.format_exc()
-            sentry_logger.error(msg=e, extra={
-                'trace': traceback_log,
-                'locals': locals()
-            })
-
-        posts_queryset.update(is_stat_fetching=False,
-                              last_stat_fetch_date=timezone.make_aware(datetime.now(), timezone.get_default_timezone()))
+            processed += len(posts)
+            await run_db(checkpoint.save, chunk_ids[-1])
+
+        await run_db(checkpoint.clear)
+
+        if not processed:
+            logger.error('Posts are empty, {} ids'.format(len(task_message.post_ids)))
+            return False
 
         return True
+
+    async def _fetch_stats_chunk(self, posts, tokens, priority):
+        posts_by_owner = defaultdict(list)
+        for post in posts:
+            if post.user_id not in tokens:
+                continue
+            posts_by_owner[(tokens[post.user_id], post.group.group_id)].append(post)
+
+        # один вызов getPostReach на пачку постов одного сообщества
+        items = []
+        for (access_token, group_id), owner_posts in posts_by_owner.items():
+            items.extend(
+                self._post_reach_item(access_token, group_id, posts_chunk)
+                for posts_chunk in split_list(owner_posts, POST_REACH_CHUNK_SIZE)
+            )
+
+        suspicious = await run_db(SuspiciousUsersReporter.load, posts)
+
+        # токены разных пользователей опрашиваются параллельно
+        results = await self._fetch_post_reach(items, priority)
+
+        # вся работа с БД по одному execute-запросу - один вызов вне event loop
+        views_stats = ViewsStatAggregator()
+        errors = ErrorReporter('get_stats_post')
+        for request_results in split_by_request(results):
+            await run_db(
+                self._process_stats_results,
+                split_post_reach(request_results),
+                views_stats,
+                suspicious,
+                errors
+            )
+
+        # прирост просмотров за порцию пишется одним UPDATE на ключ
+        await run_db(views_stats.flush)
+        await suspicious.send()
+        errors.flush()
+
+    @staticmethod
+    def _post_reach_item(access_token, group_id, posts):
+        return (
+            access_token,
+            ExecuteMethod.construct(
+                ExecuteMethod.STATS_ENTITY,
+                ExecuteMethod.POST_REACH,
+                json.dumps({
+                    VK_MESSAGE_KEY.OWNER_ID: format_group_id(group_id),
+                    POST_IDS_KEY: ','.join(str(post.post_id) for post in posts)
+                })
+            ),
+            posts
+        )
+
+    async def _fetch_post_reach(self, items, priority) -> list:
+        """
+        Runs packed getPostReach items. A call that failed on its own (not
+        the whole execute request) is retried post by post, so one bad
+        post does not fail the other posts of its chunk.
+        """
+        results = await execute_batcher.run(items, priority=priority)
+
+        kept, retry_items = [], []
+        for (access_token, _, chunk_posts), result in zip(items, results):
+            if result.is_failed and not result.is_request_failed and len(chunk_posts) > 1:
+                retry_items.extend(
+                    self._post_reach_item(access_token, post.group.group_id, [post]) for post in chunk_posts
+                )
+            else:
+                kept.append(result)
+
+        if retry_items:
+            logger.info('Retrying {} posts of failed getPostReach chunks one by one'.format(len(retry_items)))
+            kept.extend(await execute_batcher.run(retry_items, priority=priority))
+        return kept
+
+    def _load_stats_chunk(self, post_ids):
+        """Loads posts of one chunk of ids and marks them as being fetched."""
+        posts = list(
+            Post.objects.filter(pk__in=post_ids, group__members__gt=5000)
+            .select_related('group', 'user', 'campaign')
+            .order_by('pk')
+        )
+        if posts:
+            Post.objects.filter(pk__in=[post.pk for post in posts]).update(is_stat_fetching=True)
+        return posts
+
+    def _load_stats_tokens(self, posts) -> dict:
+        """{user_id: access token} of post owners, users without VK credentials are skipped."""
+        user_ids = {post.user_id for post in posts}
+        self._prefetch_vk_credentials(user_ids)
+
+        tokens = {}
+        for user_id in user_ids:
+            try:
+                tokens[user_id] = self._get_vk_credentials_by_id(user_id)[1]
+            except Exception as e:
+                logger.error(e)
+        return tokens
+
+    def _process_stats_results(self, results, views_stats, suspicious, errors):
+        for response_dict in failed_responses(results):
+            if not response_dict:
+                sentry_logger.error(msg="False response on get stat Post")
+            else:
+                sentry_logger.warning(msg={
+                    'error': response_dict
+                })
+
+        observed = {}
+        stats = PostStatsUpserter([result.entity for result in results if not result.is_request_failed])
+        ensure_united_posts_stats([result.entity for result in results if not result.is_failed and result.response])
+
+        for result in results:
+            if result.is_request_failed:
+                continue
+
+            post = result.entity
+
+            if result.is_failed:
+                error = result.error
+                if error:
+                    stats.set(post, vk_response=error)
+                    errors.add(post, error, level='warning')
+                    SocialService.vk_check_post(SocialType.VK, post_id=post.pk)
+                continue
+
+            if not result.response:
+                continue
+
+            posts_array = result.response
+            post_stats = stats.get(post)
+            observed[post.pk] = posts_array[0].get('reach_total')
+
+            if 'reach_subscribers' in posts_array[0] and 'reach_total' in posts_array[0]:
+                if post.campaign.campaign_type in [AdvertisingCampaign.VK_VIDEO_POST,
+                                                   AdvertisingCampaign.VK_REPOST]:
+                    last_views = int(
+                        post_stats.reach.split('/')[1].replace('-', '0')) if post_stats.reach else 0
+                    diff = posts_array[0]['reach_total'] - last_views
+                    views_stats.add(post.group_id, post.campaign_id, post.user_id, diff)
+
+                stats.set(post, reach='{}/{}'.format(
+                    str(posts_array[0]['reach_subscribers']),
+                    str(posts_array[0]['reach_total'])
+                ))
+            try:
+                suspicious.report(post, 'reach', posts_array[0].get('reach_total'))
+            except Exception as e:
+                sentry_logger.error(msg=e)
+
+        stats.flush()
+        refresh_scheduler.observe(RefreshScheduler.POST_REACH, observed)
+
+        Post.objects.filter(pk__in=[result.entity.pk for result in results]).update(
+            is_stat_fetching=False,
+            last_stat_fetch_date=timezone.make_aware(datetime.now(), timezone.get_default_timezone())
+        )
@@ -1,16 +1,13 @@
 import json
 import traceback
+from collections import Counter
 from datetime import datetime
-from itertools import groupby
+from math import ceil
 
 from dateutil.tz import tzlocal
 from django.utils import timezone
-from transliterate import translit
 
-from application.settings import StatsClient
 from core.models import Video
-from core.models.stats import ViewsStat
-from core.models.vk import SuspiciousUser
 from platforms.utils import (
     split_list,
     VK_MESSAGE_KEY,
@@ -20,35 +17,120 @@ from platforms.vk import (
     logger,
     sentry_logger
 )
+from platforms.vk.changes import ViewsStatAggregator
+from platforms.vk.db import run_db
+from platforms.vk.execute_batcher import (
+    ExecuteBatcher,
+    failed_responses,
+    split_by_request,
+    video_execute_batcher
+)
 from platforms.vk.methods import VKBasePlatform
-from platforms.vk.methods.vk_methods.execute import (
-    ExecuteMethod,
-    VideoExecuteMethod
+from platforms.vk.methods.vk_methods.execute import ExecuteMethod
+from platforms.vk.metrics import SuspiciousUsersReporter
+from platforms.vk.refresh import (
+    RefreshScheduler,
+    refresh_scheduler
 )
 from social_services.message import GetStatsVideoMessage
 
+# video.get принимает до 200 видео за вызов
+VIDEO_GET_SIZE = 200
+
 
 class GetStatsVideo(VKBasePlatform):
 
     async def get_stats_video(self, task_message: GetStatsVideoMessage) -> bool:
-        videos = Video.objects.all().filter(pk__in=task_message.video_ids)
-        if not videos:
-            logger.error('Videos is empty {}'.format(task_message.video_ids))
-            return False
-
-        videos.update(is_stat_fetching=True)
+        # видео, просмотры которых давно не меняются, опрашиваются реже
+        video_ids = await run_db(
+            refresh_scheduler.select,
+            RefreshScheduler.VIDEO_VIEWS,
+            task_message.video_ids,
+            force=getattr(task_message, 'force_refresh', False)
+        )
+        if not video_ids:
+            return True
+
+        videos = Video.objects.all().filter(pk__in=video_ids)
         try:
-            for owner, user_videos in groupby(
-                    videos,
-                    lambda video: video.owner if video.owner else video.user.social_auth.get(provider='vk-oauth2').uid
-            ):
-                user_videos = list(user_videos)
-                user = user_videos[0].user
-                social_uid, access_token = self._get_vk_credentials(user)
+            owners = await run_db(self._load_video_owners, videos)
+            if not owners:
+                logger.error('Videos is empty {}'.format(task_message.video_ids))
+                return False
+
+            items = self._plan_video_calls(owners)
+
+            suspicious = await run_db(
+                SuspiciousUsersReporter.load,
+                [video for _, _, user_videos in owners for video in user_videos]
+            )
 
-                video_parts = split_list(user_videos, 200)
+            results = await video_execute_batcher.run(items, priority=task_message.priority)
+
+            views_stats = ViewsStatAggregator()
+            for request_results in split_by_request(results):
+                await run_db(self._process_stats_video_results, request_results, views_stats, suspicious)
+
+            # прирост просмотров за всю задачу пишется одним UPDATE на ключ
+            await run_db(views_stats.flush)
+            await suspicious.send()
+
+        except Exception as e:
+            traceback_log = traceback.format_exc()
+            sentry_logger.error(msg=e, extra={
+                'trace': traceback_log,
+                'videos_count': len(video_ids)
+            })
+        finally:
+            await run_db(
+                videos.update,
+                is_stat_fetching=False,
+                last_stat_fetch_date=timezone.make_aware(datetime.now(), timezone.get_default_timezone())
+            )
+        return True
 
-                execute_calls = [
+    def _load_video_owners(self, videos):
+        videos = list(videos.select_related('user', 'group', 'campaign').order_by('owner', 'user_id'))
+        if not videos:
+            return []
+
+        Video.objects.filter(pk__in=[video.pk for video in videos]).update(is_stat_fetching=True)
+        self._prefetch_vk_credentials(video.user_id for video in videos)
+
+        # пользователи без VK авторизации пропускаются, их видео не опрашиваются
+        credentials = {}
+        for user_id in {video.user_id for video in videos}:
+            try:
+                credentials[user_id] = self._get_vk_credentials_by_id(user_id)
+            except Exception as e:
+                logger.error(e)
+
+        # видео без owner принадлежат пользователю; сортировка в БД собирает их подряд,
+        # словарь объединяет владельца целиком, даже если его видео пришли не подряд
+        videos_by_owner = {}
+        for video in videos:
+            if video.user_id not in credentials:
+                continue
+            owner = video.owner if video.owner else credentials[video.user_id][0]
+            videos_by_owner.setdefault(owner, []).append(video)
+
+        return [
+            (owner, credentials[user_videos[0].user_id][1], user_videos)
+            for owner, user_videos in videos_by_owner.items()
+        ]
+
+    @staticmethod
+    def _plan_video_calls(owners) -> list:
+        """
+        Builds (access_token, call, videos) items: one video.get per
+        VIDEO_GET_SIZE videos of an owner. Calls of all owners are queued
+        together, so owners sharing a token fill the same execute requests.
+        """
+        items = []
+        for owner, access_token, user_videos in owners:
+            items.extend(
+                (
+                    access_token,
                     ExecuteMethod.construct(
                         ExecuteMethod.VIDEO_ENTITY,
                         ExecuteMethod.GET_METHOD,
@@ -57,106 +139,80 @@ class GetStatsVideo(VKBasePlatform):
                             VK_MESSAGE_KEY.COUNT: len(video_part),
                             VK_MESSAGE_KEY.VIDEOS: format_videos_ids(owner, video_part)
                         })
-                    ) for video_part in video_parts
-                ]
-
-                execute_parts = split_list(execute_calls, 25)
-                video_execute_parts = split_list(video_parts, 25)
-
-                for index_part, execute_part in enumerate(execute_parts):
-                    method = VideoExecuteMethod(
-                        priority=task_message.priority,
-                        access_token=access_token,
-                        code=ExecuteMethod.construct_code(execute_part)
-                    )
-
-                    response_dict = await method.execute()
-
-                    if not response_dict:
-                        traceback_log = traceback.format_exc()
-                        sentry_logger.error(msg="False response on get stat Video", extra={
-                            'trace': traceback_log,
-                            'locals': locals()
-                        })
-                        continue
-
-                    response_list = response_dict.get(VK_MESSAGE_KEY.RESPONSE)
-                    if VK_MESSAGE_KEY.ERROR in response_dict or VK_MESSAGE_KEY.EXECUTE_ERRORS in response_dict:
-
-                        sentry_error = {
-                            'error': response_dict
-                        }
-                        sentry_logger.warning(msg=sentry_error)
-
-                        for index, videos_err in enumerate(video_execute_parts[index_part]):
-                            for video in videos_err:
-                                video.is_stat_fetching = False
-                                video.last_stat_fetch_date = datetime.now(tzlocal())
-                                video.save()
-                    else:
-                        video_execute_part = video_execute_parts[index_part]
-                        for index, video_part in enumerate(video_execute_part):
-                            if response_list[index]:
-                                video_get_array = response_list[index]
-                                # первый элемент - количество видео в одном видео гет
-                                video_get_array.pop(0)
-
-                                for video_part_index, video in enumerate(video_part):
-                                    video.is_stat_fetching = False
-                                    video_array = []
-
-                                    if video_get_array:
-                                        video_array = list(filter(lambda vid_dict: vid_dict.get('vid') == video.vid,
-                                                                  video_get_array))
-
-                                    if len(video_array):
-                                        video_dict = video_array[0]
-
-                                        diff = video_dict["views"] - video.views
-                                        try:
-                                            if SuspiciousUser.objects.filter(user=video.user,
-                                                                             campaign=video.campaign
-                                                                             ).count() > 0:
-                                                views_tags = {
-                                                    'type': 'views',
-                                                    'campaign_pk': video.campaign.pk,
-                                                    'user_pk': video.user.pk,
-                                                    'user': translit(str(video.user), 'ru', reversed=True),
-                                                    'group_pk': video.group.pk,
-                                                    'group_name': translit(video.group.name, 'ru', reversed=True)
-                                                }
-                                                StatsClient.event('video-seed__suspicious_users', value=diff,
-                                                                  tags=views_tags)
-                                        except Exception as e:
-                                            sentry_logger.error(msg=e)
-
-                                        views = video_dict["views"]
-                                        video.views = views
-                                        video.is_stat_fetching = False
-                                        video.last_stat_fetch_date = datetime.now(tzlocal())
-                                        video.save()
-
-                                        today = timezone.make_aware(
-                                            datetime.now(),
-                                            timezone.get_default_timezone()
-                                        ).date()
-
-                                        views_stat, _ = ViewsStat.objects.get_or_create(
-                                            group=video.group,
-                                            campaign=video.campaign,
-                                            date__contains=today,
-                                            user=video.user
-                                        )
-                                        if diff:
-                                            views_stat.views += diff
-                                            views_stat.save()
-        except Exception as e:
-            traceback_log = traceback.format_exc()
-            sentry_logger.error(msg=e, extra={
-                'trace': traceback_log,
-                'locals': locals()
-            })
-
-        videos.update(is_stat_fetching=False,
-                      last_stat_fetch_date=timezone.make_aware(datetime.now(), timezone.get_default_timezone()))
-        return True
+                    ),
+                    video_part
+                ) for video_part in split_list(user_videos, VIDEO_GET_SIZE)
+            )
+
+        calls_by_token = Counter(access_token for access_token, _, _ in items)
+        videos_count = sum(len(user_videos) for _, _, user_videos in owners)
+        requests_count = sum(ceil(calls / ExecuteBatcher.BATCH_SIZE) for calls in calls_by_token.values())
+        logger.info('Video stats plan: {} videos, {} video.get calls, {} execute requests '
+                    '({:.1f} per 1000 videos)'.format(
+            videos_count,
+            len(items),
+            requests_count,
+            requests_count * 1000 / videos_count
+        ))
+
+        return items
+
+    @staticmethod
+    def _match_videos(video_part, video_get_response) -> list:
+        """(video, its video.get item) pairs of a part, via one vid-keyed index."""
+        # первый элемент - количество видео в одном видео гет
+        video_dicts = {video_dict.get('vid'): video_dict for video_dict in video_get_response[1:]}
+        return [
+            (video, video_dicts[video.vid]) for video in video_part if video.vid in video_dicts
+        ]
+
+    def _process_stats_video_results(self, results, views_stats, suspicious):
+        for response_dict in failed_responses(results):
+            if not response_dict:
+                sentry_logger.error(msg="False response on get stat Video")
+
+        fetch_date = datetime.now(tzlocal())
+        failed_videos, updated_videos = [], []
+        observed = {}
+
+        for result in results:
+            video_part = result.entity
+
+            if result.is_failed:
+                if result.response_dict:
+                    sentry_error = {
+                        'error': result.error or result.response_dict
+                    }
+                    sentry_logger.warning(msg=sentry_error)
+
+                failed_videos.extend(video_part)
+                continue
+
+            if not result.response:
+                continue
+
+            for video, video_dict in self._match_videos(video_part, result.response):
+                diff = video_dict["views"] - video.views
+                try:
+                    suspicious.report(video, 'views', diff)
+                except Exception as e:
+                    sentry_logger.error(msg=e)
+
+                video.views = video_dict["views"]
+                observed[video.pk] = video.views
+                video.is_stat_fetching = False
+                video.last_stat_fetch_date = fetch_date
+                updated_videos.append(video)
+
+                views_stats.add(video.group_id, video.campaign_id, video.user_id, diff)
+
+        if failed_videos:
+            Video.objects.filter(pk__in=[video.pk for video in failed_videos]).update(
+                is_stat_fetching=False,
+                last_stat_fetch_date=fetch_date
+            )
+
+        if updated_videos:
+            Video.objects.bulk_update(updated_videos, ['views', 'is_stat_fetching', 'last_stat_fetch_date'])
+
+        refresh_scheduler.observe(RefreshScheduler.VIDEO_VIEWS, observed)
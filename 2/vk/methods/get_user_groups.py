@@ -1,3 +1,4 @@
+from application import settings
 from core.models import (
     User,
     Group,
@@ -5,57 +6,97 @@ from core.models import (
 )
 from platforms.utils import VK_MESSAGE_KEY
 from platforms.vk import sentry_logger
+from platforms.vk.changes import assign_changed
+from platforms.vk.db import run_db
 from platforms.vk.methods import VKBasePlatform
 from platforms.vk.methods.vk_methods.groups import GroupsGetMethod
 from social_services.message import GetUserGroupsMessage
 
+# groups.get отдает не больше 1000 сообществ за запрос
+VK_GROUPS_PAGE_SIZE = getattr(settings, 'VK_GROUPS_PAGE_SIZE', 1000)
+
 
 class GetUserGroups(VKBasePlatform):
 
     async def get_user_groups(self, task_message: GetUserGroupsMessage):
-        user = User.objects.get(pk=task_message.user_pk)
-        social_uid, access_token = self._get_vk_credentials(user)
-        method = GroupsGetMethod(
-            access_token=access_token,
-            user_id=social_uid,
-            extended=1,
-            fields='members_count,can_post',
-            filter='admin,editor,moder',
-            priority=task_message.priority
-        )
-        response_dict = await method.execute()
-
-        if VK_MESSAGE_KEY.ERROR in response_dict:
-            sentry_logger.error(msg='Authorization Failed: User - {}'.format(user.get_full_name()))
-            return False
-
-        if not response_dict:
-            sentry_logger.error('No response on get_user_groups: User - {}'.format(user.get_full_name()))
-            return False
-
-        response = response_dict.get(VK_MESSAGE_KEY.RESPONSE)
-
-        if not response or len(response) < 2:
-            sentry_logger.error('No vk response key in get_user_groups response, {} User - {}'.format(
-                response,
-                user.get_full_name()
-            ))
-            return False
-
-        group_items = response.get(VK_MESSAGE_KEY.ITEMS)
-
-        for group_item in group_items:
-            try:
-                group = Group.objects.get(group_id=group_item["id"])
-            except Group.DoesNotExist:
-                group = Group(
-                    group_id=group_item["id"],
-                    name=group_item["name"],
-                    members=group_item.get("members_count", 0)
-                )
-                group.save()
-
-            group.name = group_item["name"] if group.name != group_item["name"] else group.name
+        user, (social_uid, access_token) = await run_db(self._load_user_credentials, task_message.user_pk)
+
+        group_items = []
+        offset = 0
+        while True:
+            method = GroupsGetMethod(
+                access_token=access_token,
+                user_id=social_uid,
+                extended=1,
+                fields='members_count,can_post',
+                filter='admin,editor,moder',
+                offset=offset,
+                count=VK_GROUPS_PAGE_SIZE,
+                priority=task_message.priority
+            )
+            response_dict = await method.execute()
+
+            if not response_dict:
+                sentry_logger.error('No response on get_user_groups: User - {}'.format(user.get_full_name()))
+                return False
+
+            if VK_MESSAGE_KEY.ERROR in response_dict:
+                sentry_logger.error(msg='Authorization Failed: User - {}'.format(user.get_full_name()))
+                return False
+
+            response = response_dict.get(VK_MESSAGE_KEY.RESPONSE)
+
+            if not response or len(response) < 2:
+                sentry_logger.error('No vk response key in get_user_groups response, {} User - {}'.format(
+                    response,
+                    user.get_full_name()
+                ))
+                return False
+
+            page_items = response.get(VK_MESSAGE_KEY.ITEMS) or []
+            group_items.extend(page_items)
+            offset += len(page_items)
+
+            if not page_items or offset >= response.get(VK_MESSAGE_KEY.COUNT, 0):
+                break
+
+        return await run_db(self._sync_user_groups, user, group_items)
+
+    def _load_user_credentials(self, user_pk):
+        user = User.objects.get(pk=user_pk)
+        return user, self._get_vk_credentials(user)
+
+    def _sync_user_groups(self, user, group_items):
+        group_items = {group_item["id"]: group_item for group_item in group_items}
+
+        groups = {group.group_id: group for group in Group.objects.filter(group_id__in=list(group_items))}
+
+        new_groups = [
+            Group(
+                group_id=group_id,
+                name=group_item["name"],
+                members=group_item.get("members_count", 0)
+            ) for group_id, group_item in group_items.items() if group_id not in groups
+        ]
+        if new_groups:
+            # сообщество мог одновременно создать другой админ - такие строки пропускаются
+            Group.objects.bulk_create(new_groups, ignore_conflicts=True)
+            # первичные ключи созданных сообществ нужны для UserGroup
+            groups.update(
+                (group.group_id, group)
+                for group in Group.objects.filter(group_id__in=[group.group_id for group in new_groups])
+            )
+
+        user_groups = {
+            user_group.group_id: user_group
+            for user_group in UserGroup.objects.filter(user=user, group_id__in=[group.pk for group in groups.values()])
+        }
+
+        changed_groups, group_fields = [], set()
+        new_user_groups, changed_user_groups, user_group_fields = [], [], set()
+
+        for group_id, group_item in group_items.items():
+            group = groups[group_id]
 
             if VK_MESSAGE_KEY.DEACTIVATED in group_item:
                 sentry_logger.warning(msg={
@@ -64,26 +105,54 @@ class GetUserGroups(VKBasePlatform):
                 })
                 continue
 
-            try:
-                group.members = group_item["members_count"] \
-                    if group.members != group_item["members_count"] else group.members
-            except Exception as e:
-                sentry_logger.error(msg=e)
-            group.is_closed = bool(group_item['is_closed']) \
-                if group.is_closed != bool(group_item['is_closed']) else group.is_closed
-
-            group.groups_img = group_item.get("photo_50") \
-                if group.groups_img != group_item.get("photo_50") else group.groups_img
-            group.save()
-
-            user_group, created = UserGroup.objects.get_or_create(user=user, group=group)
-
-            user_group.is_admin = bool(group_item.get('is_admin')) \
-                if user_group.is_admin != bool(group_item.get('is_admin')) else user_group.is_admin
+            values = {
+                'name': group_item["name"],
+                'is_closed': bool(group_item['is_closed']),
+                'groups_img': group_item.get("photo_50")
+            }
+            if "members_count" in group_item:
+                values['members'] = group_item["members_count"]
+
+            changed = assign_changed(group, **values)
+            if changed:
+                changed_groups.append(group)
+                group_fields |= changed
+
+            user_group_values = {
+                'is_admin': bool(group_item.get('is_admin')),
+                'admin_level': group_item.get('admin_level', UserGroup.ADMIN)
+            }
+
+            user_group = user_groups.get(group.pk)
+            if user_group is None:
+                new_user_groups.append(UserGroup(user=user, group=group, **user_group_values))
+                continue
 
-            user_group.admin_level = group_item.get('admin_level', UserGroup.ADMIN) \
-                if user_group.admin_level != group_item.get('admin_level', UserGroup.ADMIN) else user_group.admin_level
+            changed = assign_changed(user_group, **user_group_values)
+            if changed:
+                changed_user_groups.append(user_group)
+                user_group_fields |= changed
+
+        if changed_groups:
+            Group.objects.bulk_update(changed_groups, sorted(group_fields))
+
+        if new_user_groups:
+            UserGroup.objects.bulk_create(new_user_groups, ignore_conflicts=True)
+
+            # строки, созданные параллельной синхронизацией, перечитываются и дописываются bulk_update
+            created = {user_group.group_id: user_group for user_group in new_user_groups}
+            for user_group in UserGroup.objects.filter(user=user, group_id__in=list(created)):
+                new_user_group = created[user_group.group_id]
+                changed = assign_changed(
+                    user_group,
+                    is_admin=new_user_group.is_admin,
+                    admin_level=new_user_group.admin_level
+                )
+                if changed:
+                    changed_user_groups.append(user_group)
+                    user_group_fields |= changed
 
-            user_group.save()
+        if changed_user_groups:
+            UserGroup.objects.bulk_update(changed_user_groups, sorted(user_group_fields))
 
         return True
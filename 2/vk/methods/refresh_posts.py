@@ -0,0 +1,11 @@
+from platforms.vk.methods import VKBasePlatform
+from social_services.message import VkBulkCheckPostMessage
+
+
+class RefreshPosts(VKBasePlatform):
+
+    async def refresh_posts(self, task_message: VkBulkCheckPostMessage):
+        # проверка и сбор лайков/репостов читают один снимок wall.getById,
+        # поэтому второй шаг не делает повторных запросов в ВК
+        await self.bulk_check_post(task_message)
+        return await self.get_likes_reposts(task_message)
@@ -11,6 +11,7 @@ from core.models import (
 )
 from platforms.utils import VK_MESSAGE_KEY
 from platforms.vk import sentry_logger
+from platforms.vk.db import run_db
 from platforms.vk.methods import VKBasePlatform
 from platforms.vk.methods.vk_methods.wall import WallRepost
 from social_services.message import RepostTaskMessage
@@ -20,16 +21,7 @@ from social_services.social_service import SocialService
 class Repost(VKBasePlatform):
 
     async def repost(self, task_message: RepostTaskMessage):
-        post = Post.objects.get(pk=task_message.post_id)
-
-        user = User.objects.get(pk=task_message.user_id)
-        campaign = AdvertisingCampaign.objects.get(pk=task_message.campaign_id)
-        group = Group.objects.get(pk=task_message.target_group_id)
-
-        custom_campaign = CustomCampaign.objects.filter(user=user, campaign=campaign)
-        text = campaign.text if not custom_campaign else custom_campaign.first().text
-
-        social_uid, access_token = self._get_vk_credentials(user=user)
+        post, campaign, group, text, access_token = await run_db(self._load_repost, task_message)
         post_link = campaign.link.split('=')[1]
 
         method = WallRepost(
@@ -43,6 +35,22 @@ class Repost(VKBasePlatform):
         response_dict = await method.execute()
         response = response_dict.get(VK_MESSAGE_KEY.RESPONSE, {})
 
+        return await run_db(self._finish_repost, post, response)
+
+    def _load_repost(self, task_message: RepostTaskMessage):
+        post = Post.objects.get(pk=task_message.post_id)
+
+        user = User.objects.get(pk=task_message.user_id)
+        campaign = AdvertisingCampaign.objects.get(pk=task_message.campaign_id)
+        group = Group.objects.get(pk=task_message.target_group_id)
+
+        custom_campaign = CustomCampaign.objects.filter(user=user, campaign=campaign)
+        text = campaign.text if not custom_campaign else custom_campaign.first().text
+
+        social_uid, access_token = self._get_vk_credentials(user=user)
+        return post, campaign, group, text, access_token
+
+    def _finish_repost(self, post, response):
         try:
             if response.get("success"):
                 post.status = Post.IS_ACTIVE
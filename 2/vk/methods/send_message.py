@@ -1,6 +1,7 @@
 from application.settings import VK_GROUP_TOKEN
 from core.models.messages import VKMessagesLog
 from platforms.utils import VK_MESSAGE_KEY
+from platforms.vk.db import run_db
 from platforms.vk.methods.vk_methods.wall import SendMessage as VKSendMessage
 from social_services.message import SendMessageTaskMessage
 
@@ -18,7 +19,8 @@ class SendMessage:
         response_dict = await method.execute()
 
         if response_dict.get(VK_MESSAGE_KEY.RESPONSE):
-            VKMessagesLog.objects.create(
+            await run_db(
+                VKMessagesLog.objects.create,
                 type=task_message.vk_message_type,
                 message=task_message.message,
                 recipient=task_message.user_id
@@ -11,6 +11,7 @@ from platforms.utils import (
     format_group_id,
     VK_MESSAGE_KEY
 )
+from platforms.vk.db import run_db
 from platforms.vk.methods import VKBasePlatform
 from platforms.vk.methods.vk_methods.wall import WallPostMethod
 from social_services.message import VideoPostTaskMessage
@@ -20,16 +21,7 @@ from social_services.social_service import SocialService
 class VideoPost(VKBasePlatform):
 
     async def video_post(self, task_message: VideoPostTaskMessage):
-        post = Post.objects.get(pk=task_message.post_id)
-
-        user = User.objects.get(pk=task_message.user_id)
-        campaign = AdvertisingCampaign.objects.get(pk=task_message.campaign_id)
-        group = Group.objects.get(pk=task_message.target_group_id)
-
-        custom_campaign = CustomCampaign.objects.filter(user=user, campaign=campaign)
-        text = campaign.text if not custom_campaign else custom_campaign.first().text
-
-        social_uid, access_token = self._get_vk_credentials(user=user)
+        post, campaign, group, text, access_token = await run_db(self._load_video_post, task_message)
         video_owner, video_vid = campaign.link.split('video-')[1].split('_')
 
         method = WallPostMethod(
@@ -46,7 +38,8 @@ class VideoPost(VKBasePlatform):
 
         response_dict = await method.execute()
 
-        if not self.check_response(
+        if not await run_db(
+                self.check_response,
                 post,
                 response_dict,
                 fail_status=Post.FAILED,
@@ -57,6 +50,22 @@ class VideoPost(VKBasePlatform):
         response = response_dict.get(VK_MESSAGE_KEY.RESPONSE)
         post.status = Post.IS_ACTIVE
         post.post_id = response.get(VK_MESSAGE_KEY.POST_ID)
+        return await run_db(self._finish_video_post, post)
+
+    def _load_video_post(self, task_message: VideoPostTaskMessage):
+        post = Post.objects.get(pk=task_message.post_id)
+
+        user = User.objects.get(pk=task_message.user_id)
+        campaign = AdvertisingCampaign.objects.get(pk=task_message.campaign_id)
+        group = Group.objects.get(pk=task_message.target_group_id)
+
+        custom_campaign = CustomCampaign.objects.filter(user=user, campaign=campaign)
+        text = campaign.text if not custom_campaign else custom_campaign.first().text
+
+        social_uid, access_token = self._get_vk_credentials(user=user)
+        return post, campaign, group, text, access_token
+
+    def _finish_video_post(self, post):
         post.save()
 
         post_screen_exists = GroupPostImgs.objects.filter(group__group_id=post.group.group_id,
@@ -12,4 +12,6 @@ class GroupsGetMethod(BaseVkClient):
         'extended': Argument(type=int, required=True),
         'filter': Argument(type=str, required=True),
         'fields': Argument(type=str, required=True),
+        'offset': Argument(type=int, required=False),
+        'count': Argument(type=int, required=False),
     }
@@ -1,16 +1,61 @@
 import logging
+import re
 
-from bs4 import BeautifulSoup
-
+from application import settings
 from platforms.client.base import async_message_rate_limit
 from platforms.client.sender import Sender
 from platforms.client.vk import BaseVkClient
 from platforms.utils import VK_MESSAGE_KEY
 from platforms.utils.arguments import Argument
+from platforms.vk.http import (
+    VK_POOLED_HTTP,
+    vk_http
+)
 
 logger = logging.getLogger('django')
 sentry_logger = logging.getLogger('sentry')
 
+# полный разбор HTML через BeautifulSoup - только для отладки классификатора
+VK_ERROR_BODY_DEBUG_PARSE = getattr(settings, 'VK_ERROR_BODY_DEBUG_PARSE', False)
+ERROR_BODY_PREFIX = 2048
+
+BODY_HTML = 'html'
+BODY_JSON = 'json'
+BODY_TOO_MUCH_REQUESTS = 'too_much_requests'
+BODY_TEXT = 'text'
+
+HTML_TAG_RE = re.compile(r'<(?:!doctype|!--|/?[a-z][a-z0-9]*[\s/>])', re.IGNORECASE)
+
+
+def classify_error_body(doc) -> str:
+    """
+    Tells what an unparsable VK response body is by its first
+    ERROR_BODY_PREFIX characters: an HTML page, the "Too much requests"
+    text, a (broken) JSON error or plain text.
+    """
+    if not isinstance(doc, str):
+        doc = doc.decode('utf-8', errors='replace') if isinstance(doc, bytes) else str(doc)
+
+    prefix = doc[:ERROR_BODY_PREFIX].lstrip()
+
+    if prefix.rstrip() == VideoSaveMethod.TOO_MUCH_REQUESTS_MSG:
+        return BODY_TOO_MUCH_REQUESTS
+
+    if prefix[:1] in ('{', '['):
+        return BODY_JSON
+
+    if HTML_TAG_RE.search(prefix):
+        return BODY_HTML
+
+    if VK_ERROR_BODY_DEBUG_PARSE:
+        from bs4 import BeautifulSoup
+
+        if BeautifulSoup(doc, 'html.parser').find():
+            logger.warning('HTML body missed by the error body classifier: {}'.format(prefix[:200]))
+            return BODY_HTML
+
+    return BODY_TEXT
+
 
 class VideoSaveMethod(BaseVkClient):
     METHOD = 'video.save'
@@ -18,6 +63,7 @@ class VideoSaveMethod(BaseVkClient):
 
     TOO_MUCH_REQUESTS_MSG = 'Too much requests'
     SERVICE_UNAVAILABLE = 'Page temporary unavailable'
+    UPLOAD_BREAKER_KEY = 'video.upload'
 
     ARGUMENTS = {
         'access_token': Argument(type=str, required=True),
@@ -31,28 +77,35 @@ class VideoSaveMethod(BaseVkClient):
     @async_message_rate_limit()
     async def toggle_upload_link(upload_url: str):
         try:
-            response = await Sender.get(upload_url, {})
+            if VK_POOLED_HTTP:
+                # постоянный пул соединений вместо нового соединения на каждый запрос
+                response = await vk_http.get(upload_url)
+            else:
+                response = await Sender.get(upload_url, {})
         except Exception as e:
             logger.error(e)
             if hasattr(e, 'doc'):
+                body_kind = classify_error_body(e.doc)
+                if body_kind == BODY_TOO_MUCH_REQUESTS:
+                    return VideoSaveMethod.TOO_MUCH_REQUESTS_MSG
+
                 msg = {
                     'url': upload_url,
-                    'response': e.doc
+                    'kind': body_kind,
+                    'response': e.doc[:ERROR_BODY_PREFIX]
                 }
-                if e.doc == VideoSaveMethod.TOO_MUCH_REQUESTS_MSG:
-                    return e.doc
-                elif bool(BeautifulSoup(e.doc, "html.parser").find()):
-                    sentry_logger.error(msg=msg, extra={
-                        'html': e.doc
-                    })
+                sentry_logger.error(msg=msg)
+                if body_kind == BODY_HTML:
                     return VideoSaveMethod.SERVICE_UNAVAILABLE
-                else:
-                    sentry_logger.error(msg=msg)
 
             return False
 
         return response.get(VK_MESSAGE_KEY.RESPONSE) == 1
 
+    @staticmethod
+    def is_toggle_retryable(toggle_result) -> bool:
+        return toggle_result in (VideoSaveMethod.TOO_MUCH_REQUESTS_MSG, VideoSaveMethod.SERVICE_UNAVAILABLE)
+
 
 class VideoDeleteMethod(BaseVkClient):
     METHOD = 'video.delete'
@@ -0,0 +1,92 @@
+import asyncio
+from functools import lru_cache
+
+from transliterate import translit
+
+from application import settings
+from application.settings import StatsClient
+from core.models.vk import SuspiciousUser
+from platforms.vk import logger
+
+VK_TRANSLIT_CACHE_SIZE = getattr(settings, 'VK_TRANSLIT_CACHE_SIZE', 4096)
+
+
+@lru_cache(maxsize=VK_TRANSLIT_CACHE_SIZE)
+def translit_name(name: str) -> str:
+    return translit(name, 'ru', reversed=True)
+
+
+class EventBuffer:
+    """
+    Collects StatsClient events during a job and sends them together from
+    a worker thread, so the collectors spend no time on the metrics client.
+    """
+
+    def __init__(self, client=StatsClient):
+        self._client = client
+        self._events = []
+
+    def __len__(self):
+        return len(self._events)
+
+    def event(self, name, **kwargs):
+        self._events.append((name, kwargs))
+
+    def flush(self):
+        events, self._events = self._events, []
+        for name, kwargs in events:
+            try:
+                self._client.event(name, **kwargs)
+            except Exception as e:
+                logger.error(e)
+
+    async def send(self):
+        if self._events:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self.flush)
+
+
+class SuspiciousUsersReporter:
+    """
+    Reports stats of suspicious users. The (user, campaign) pairs of a job
+    are loaded with one query up front, events go to an EventBuffer.
+    """
+
+    METRIC = 'video-seed__suspicious_users'
+
+    def __init__(self, pairs=(), events=None):
+        self._pairs = set(pairs)
+        self.events = events if events is not None else EventBuffer()
+
+    @classmethod
+    def load(cls, entities):
+        """Loads suspicious pairs among (user_id, campaign_id) of the entities."""
+        pairs = {(entity.user_id, entity.campaign_id) for entity in entities}
+        if not pairs:
+            return cls()
+
+        suspicious = SuspiciousUser.objects.filter(
+            user_id__in={pair[0] for pair in pairs},
+            campaign_id__in={pair[1] for pair in pairs}
+        ).values_list('user_id', 'campaign_id')
+
+        return cls(pairs & set(suspicious))
+
+    def is_suspicious(self, entity) -> bool:
+        return (entity.user_id, entity.campaign_id) in self._pairs
+
+    def report(self, entity, stat_type, value):
+        if not self.is_suspicious(entity):
+            return
+
+        self.events.event(self.METRIC, value=value, tags={
+            'type': stat_type,
+            'campaign_pk': entity.campaign_id,
+            'user_pk': entity.user_id,
+            'user': translit_name(str(entity.user)),
+            'group_pk': entity.group_id,
+            'group_name': translit_name(entity.group.name)
+        })
+
+    async def send(self):
+        await self.events.send()
@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import fcntl
+import hashlib
+import os
+import struct
+import tempfile
+import time
+import uuid
+from collections import deque
+
+from application import settings
+
+# VK разрешает 3 запроса в секунду на один пользовательский токен
+VK_REQUESTS_PER_SECOND = getattr(settings, 'VK_REQUESTS_PER_SECOND', 3)
+VK_RATE_LIMITS = getattr(settings, 'VK_RATE_LIMITS', {})
+VK_RATE_LIMIT_LEASE_SIZE = getattr(settings, 'VK_RATE_LIMIT_LEASE_SIZE', 1)
+# сколько миллисекунд можно тратить слоты, взятые про запас (lease_size > 1)
+VK_RATE_LIMIT_LEASE_TTL_MS = getattr(settings, 'VK_RATE_LIMIT_LEASE_TTL_MS', 100)
+VK_RATE_LIMIT_REDIS_URL = getattr(settings, 'VK_RATE_LIMIT_REDIS_URL', None)
+# без Redis журналы лежат в общей памяти хоста (tmpfs) и общие для всех воркеров на нем
+VK_RATE_LIMIT_SHARED_DIR = getattr(
+    settings, 'VK_RATE_LIMIT_SHARED_DIR',
+    os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'vk-rate-limit')
+)
+
+DEFAULT_FAMILY = 'execute'
+
+# KEYS[1] - журнал выданных слотов; ARGV: amount, limit, window_ms, lease_ttl_ms, nonce
+LEASE_SCRIPT = """
+local amount = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local window = tonumber(ARGV[3])
+local lease_ttl = tonumber(ARGV[4])
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local used = redis.call('ZCARD', KEYS[1])
+local granted = math.max(0, math.min(amount, limit - used))
+
+for i = 1, granted do
+    redis.call('ZADD', KEYS[1], now + lease_ttl, ARGV[5] .. ':' .. i)
+end
+redis.call('PEXPIRE', KEYS[1], window + lease_ttl)
+
+local retry_after = 0
+if used + granted >= limit then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    retry_after = math.max(1, math.ceil(tonumber(oldest[2]) + window - now))
+end
+return {granted, limit - used - granted, retry_after}
+"""
+
+
+def method_family(method) -> str:
+    """`wall.getById` -> `wall`, `execute` -> `execute`."""
+    return method.METHOD.split('.')[0]
+
+
+def _now_ms() -> float:
+    return time.monotonic() * 1000
+
+
+class LocalRateLimitBackend:
+    """Sliding-window logs of granted slots of a single process."""
+
+    def __init__(self):
+        self._logs = {}
+
+    async def lease(self, key, amount, limit, window_ms, lease_ttl_ms=0) -> tuple:
+        now = _now_ms()
+        log = self._logs.setdefault(key, deque())
+        while log and log[0] <= now - window_ms:
+            log.popleft()
+
+        granted = max(0, min(amount, limit - len(log)))
+        log.extend([now + lease_ttl_ms] * granted)
+
+        retry_after = 0
+        if len(log) >= limit:
+            retry_after = max(1, log[0] + window_ms - now)
+        if not log:
+            del self._logs[key]
+        return granted, limit - len(log), retry_after
+
+
+class SharedMemoryRateLimitBackend:
+    """
+    Sliding-window logs shared by all worker processes of one host.
+
+    Every key is a small file of packed millisecond timestamps in a tmpfs
+    directory; a lease reads, prunes and rewrites it under an exclusive
+    `flock`, so workers of the host together never get more than `limit`
+    slots within any `window_ms` interval.
+    """
+
+    STAMP = struct.Struct('<d')
+
+    def __init__(self, directory=VK_RATE_LIMIT_SHARED_DIR):
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    async def lease(self, key, amount, limit, window_ms, lease_ttl_ms=0) -> tuple:
+        # запись в tmpfs занимает микросекунды, блокировка держится только на время чтения и записи
+        fd = os.open(os.path.join(self._directory, key.replace(':', '-')), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.pread(fd, 64 * 1024, 0)
+
+            now = time.time() * 1000
+            log = [
+                stamp for stamp, in self.STAMP.iter_unpack(data[:len(data) - len(data) % self.STAMP.size])
+                if stamp > now - window_ms
+            ]
+
+            granted = max(0, min(amount, limit - len(log)))
+            log.extend([now + lease_ttl_ms] * granted)
+
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, b''.join(self.STAMP.pack(stamp) for stamp in log), 0)
+        finally:
+            os.close(fd)
+
+        retry_after = 0
+        if len(log) >= limit:
+            retry_after = max(1, min(log) + window_ms - now)
+        return granted, limit - len(log), retry_after
+
+
+class RedisRateLimitBackend:
+    """
+    Sliding-window logs in Redis shared by all worker processes.
+
+    The whole lease is a single Lua script call timed by the Redis clock,
+    so any number of workers together never get more than `limit` slots
+    within any `window_ms` interval.
+    """
+
+    def __init__(self, url):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(LEASE_SCRIPT)
+
+    async def lease(self, key, amount, limit, window_ms, lease_ttl_ms=0) -> tuple:
+        granted, available, retry_after = await self._script(
+            keys=['vk_rate:{}'.format(key)],
+            args=[amount, limit, window_ms, lease_ttl_ms, uuid.uuid4().hex]
+        )
+        return int(granted), int(available), int(retry_after)
+
+    async def check(self, limit=3, window_ms=1000) -> bool:
+        """Runs LEASE_SCRIPT on a scratch key: `limit` slots are granted, the next one is refused."""
+        key = 'check:{}'.format(uuid.uuid4().hex)
+        try:
+            granted, available, _ = await self.lease(key, limit + 1, limit, window_ms)
+            refused, _, retry_after = await self.lease(key, 1, limit, window_ms)
+        finally:
+            await self._redis.delete('vk_rate:{}'.format(key))
+        return granted == limit and available == 0 and refused == 0 and 0 < retry_after <= window_ms
+
+
+class RateLimiter:
+    """
+    Hands out request slots for (access token, method family) keys.
+
+    The backend keeps a sliding-window log per key: no more than `limit`
+    slots are granted within any WINDOW_MS interval, so there is no double
+    burst around a window boundary. With `lease_size` > 1 extra slots are
+    leased ahead and spent locally for `lease_ttl_ms`; the backend logs
+    them at the end of that period, so spending them late never exceeds
+    the limit.
+    """
+
+    WINDOW_MS = 1000
+    MAX_LEASES = 10000
+
+    def __init__(self, backend, limits=None, default_limit=VK_REQUESTS_PER_SECOND,
+                 lease_size=VK_RATE_LIMIT_LEASE_SIZE, lease_ttl_ms=VK_RATE_LIMIT_LEASE_TTL_MS):
+        self._backend = backend
+        self._limits = limits or {}
+        self._default_limit = default_limit
+        self._lease_size = lease_size
+        # одиночный слот тратится сразу, держать его про запас незачем
+        self._lease_ttl_ms = lease_ttl_ms if lease_size > 1 else 0
+        self._leases = {}
+        self._budgets = {}
+
+    def limit(self, family) -> int:
+        return self._limits.get(family, self._default_limit)
+
+    @staticmethod
+    def backend_key(access_token, family) -> str:
+        # токен не должен попадать в имена ключей Redis
+        return '{}:{}'.format(family, hashlib.sha256(access_token.encode()).hexdigest()[:32])
+
+    def remaining(self, access_token, family=DEFAULT_FAMILY) -> int:
+        """Slots already leased by this process and not expired yet."""
+        expires_at, remaining = self._leases.get((access_token, family), (0, 0))
+        return remaining if expires_at > _now_ms() else 0
+
+    def available(self, access_token, family=DEFAULT_FAMILY) -> int:
+        """
+        Slots this process can expect to get right now: its own unspent
+        lease plus the window budget the backend reported on the last
+        lease. A report older than WINDOW_MS means the whole limit.
+        """
+        key = (access_token, family)
+        reported_at, budget = self._budgets.get(key, (0, 0))
+        if reported_at <= _now_ms() - self.WINDOW_MS:
+            budget = self.limit(family)
+        return self.remaining(access_token, family) + budget
+
+    async def acquire(self, access_token, family=DEFAULT_FAMILY, amount=1):
+        key = (access_token, family)
+        limit = self.limit(family)
+
+        while True:
+            remaining = self.remaining(access_token, family)
+            if remaining >= amount:
+                self._leases[key] = (self._leases[key][0], remaining - amount)
+                return
+
+            if len(self._leases) >= self.MAX_LEASES:
+                now = _now_ms()
+                self._leases = {k: lease for k, lease in self._leases.items() if lease[0] > now}
+                self._budgets = {
+                    k: budget for k, budget in self._budgets.items() if budget[0] > now - self.WINDOW_MS
+                }
+
+            granted, available, retry_after = await self._backend.lease(
+                self.backend_key(access_token, family),
+                max(amount - remaining, self._lease_size),
+                limit,
+                self.WINDOW_MS,
+                self._lease_ttl_ms
+            )
+            self._budgets[key] = (_now_ms(), available)
+            if remaining + granted >= amount:
+                self._leases[key] = (_now_ms() + self._lease_ttl_ms, remaining + granted - amount)
+                return
+
+            self._leases[key] = (_now_ms() + self._lease_ttl_ms, remaining + granted)
+            # лимит исчерпан (в том числе другими воркерами), ждем, пока освободится старейший слот
+            await asyncio.sleep(max(retry_after, 1) / 1000)
+
+
+def get_backend():
+    if VK_RATE_LIMIT_REDIS_URL:
+        return RedisRateLimitBackend(VK_RATE_LIMIT_REDIS_URL)
+    if VK_RATE_LIMIT_SHARED_DIR:
+        return SharedMemoryRateLimitBackend(VK_RATE_LIMIT_SHARED_DIR)
+    return LocalRateLimitBackend()
+
+
+rate_limiter = RateLimiter(get_backend(), limits=VK_RATE_LIMITS)
+
+
+def main():
+    """python -m platforms.vk.rate_limit --check: runs the Lua script against VK_RATE_LIMIT_REDIS_URL."""
+    parser = argparse.ArgumentParser(description='Check of the VK rate-limit Redis backend')
+    parser.add_argument('--check', action='store_true', required=True)
+    parser.add_argument('--redis-url', default=VK_RATE_LIMIT_REDIS_URL)
+    args = parser.parse_args()
+
+    if not args.redis_url:
+        parser.error('VK_RATE_LIMIT_REDIS_URL is not set, pass --redis-url')
+
+    ok = asyncio.get_event_loop().run_until_complete(RedisRateLimitBackend(args.redis_url).check())
+    print('LEASE_SCRIPT check: {}'.format('ok' if ok else 'FAILED'))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import time
+
+from django.core.cache import cache
+
+from application import settings
+
+# по умолчанию выключено: задачи получают статистику всех переданных id
+VK_ADAPTIVE_REFRESH = getattr(settings, 'VK_ADAPTIVE_REFRESH', False)
+VK_REFRESH_MIN_INTERVAL = getattr(settings, 'VK_REFRESH_MIN_INTERVAL', 15 * 60)
+VK_REFRESH_MAX_INTERVAL = getattr(settings, 'VK_REFRESH_MAX_INTERVAL', 24 * 60 * 60)
+# {вид статистики: сколько объектов можно обновить за час}, вид без записи не ограничен
+VK_REFRESH_BUDGET_PER_HOUR = getattr(settings, 'VK_REFRESH_BUDGET_PER_HOUR', {})
+VK_REFRESH_STATE_TTL = getattr(settings, 'VK_REFRESH_STATE_TTL', 7 * 24 * 60 * 60)
+
+
+class RefreshScheduler:
+    """
+    Decides which posts / videos are worth refreshing now.
+
+    After every fetch the observed value (reach, views, likes and reposts)
+    is compared with the previous one: an item whose value changed is
+    polled again after `min_interval`, an unchanged one waits twice as
+    long as last time, up to `max_interval`. Per-kind hourly budgets cap
+    the number of items refreshed, the most overdue ones go first; only
+    items actually fetched (passed to `observe`) are charged, so jobs
+    running at the same time may overshoot a budget by their own size.
+
+    Opt-in with VK_ADAPTIVE_REFRESH; a task can bypass it with `force`.
+    The state lives in the Django cache, so all workers share it.
+    """
+
+    POST_REACH = 'post_reach'
+    POST_LIKES = 'post_likes'
+    VIDEO_VIEWS = 'video_views'
+
+    KEY = 'vk-refresh:{}:{}'
+    BUDGET_KEY = 'vk-refresh-budget:{}:{}'
+
+    def __init__(self, cache=cache, enabled=VK_ADAPTIVE_REFRESH, min_interval=VK_REFRESH_MIN_INTERVAL,
+                 max_interval=VK_REFRESH_MAX_INTERVAL, budgets=VK_REFRESH_BUDGET_PER_HOUR,
+                 state_ttl=VK_REFRESH_STATE_TTL):
+        self._cache = cache
+        self.enabled = enabled
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._budgets = budgets
+        self._state_ttl = state_ttl
+
+    def _keys(self, kind, ids) -> dict:
+        return {self.KEY.format(kind, pk): pk for pk in ids}
+
+    def select(self, kind, ids, force=False) -> list:
+        """Returns ids from `ids` due for refresh, within the hourly budget; all of them with `force`."""
+        if not self.enabled or force:
+            return list(ids)
+
+        keys = self._keys(kind, ids)
+        states = self._cache.get_many(list(keys))
+        now = time.time()
+
+        due = []
+        for key, pk in keys.items():
+            next_at = states[key]['next_at'] if key in states else 0
+            if next_at <= now:
+                due.append((next_at, pk))
+        due.sort(key=lambda item: item[0])
+
+        budget = self._budgets.get(kind)
+        if budget is not None and due:
+            due = due[:max(0, budget - self._cache.get(self._budget_key(kind), 0))]
+
+        return [pk for _, pk in due]
+
+    def _budget_key(self, kind) -> str:
+        return self.BUDGET_KEY.format(kind, int(time.time() // 3600))
+
+    def _charge_budget(self, kind, amount):
+        key = self._budget_key(kind)
+        self._cache.add(key, 0, 60 * 60)
+        self._cache.incr(key, amount)
+
+    def observe(self, kind, values):
+        """Stores values ({id: value}) of just fetched items and plans their next refresh."""
+        if not self.enabled or not values:
+            return
+
+        if kind in self._budgets:
+            self._charge_budget(kind, len(values))
+
+        keys = self._keys(kind, values)
+        states = self._cache.get_many(list(keys))
+        now = time.time()
+
+        new_states = {}
+        for key, pk in keys.items():
+            value = values[pk]
+            state = states.get(key)
+
+            if state is None or state['value'] != value:
+                interval = self._min_interval
+            else:
+                interval = min(self._max_interval, state['interval'] * 2)
+
+            new_states[key] = {
+                'value': value,
+                'interval': interval,
+                'next_at': now + interval
+            }
+
+        self._cache.set_many(new_states, self._state_ttl)
+
+
+refresh_scheduler = RefreshScheduler()
@@ -0,0 +1,143 @@
+import json
+import random
+import time
+
+from application import settings
+from platforms.utils import VK_MESSAGE_KEY
+from platforms.vk import sentry_logger
+
+VK_ERROR_SAMPLE_SIZE = getattr(settings, 'VK_ERROR_SAMPLE_SIZE', 10)
+VK_ERROR_EVENTS_PER_MINUTE = getattr(settings, 'VK_ERROR_EVENTS_PER_MINUTE', 60)
+
+
+def loaded_related(entity, name):
+    """Related object if it is already loaded on the entity, else None (no query)."""
+    field = getattr(type(entity), name, None)
+    if field is None or not hasattr(field, 'field') or not field.field.is_cached(entity):
+        return None
+    return getattr(entity, name)
+
+
+def entity_extra(entity) -> dict:
+    """Sentry extra of an entity built from FK ids and already loaded relations only."""
+    extra = {
+        'entity_id': entity.pk,
+        'campaign_id': getattr(entity, 'campaign_id', None),
+        'group_id': getattr(entity, 'group_id', None),
+        'user_id': getattr(entity, 'user_id', None)
+    }
+
+    campaign = loaded_related(entity, 'campaign')
+    if campaign is not None:
+        extra['campaign_name'] = campaign.name
+
+    group = loaded_related(entity, 'group')
+    if group is not None:
+        extra['groupname'] = group.name
+
+    user = loaded_related(entity, 'user')
+    if user is not None:
+        extra['username'] = user.get_full_name()
+
+    return extra
+
+
+def error_key(error) -> str:
+    if isinstance(error, dict):
+        code = error.get(VK_MESSAGE_KEY.ERROR_CODE)
+        if code is not None:
+            return str(code)
+        return json.dumps(error, sort_keys=True, default=str)
+    return str(error)
+
+
+class _EventRate:
+    """Process-wide cap of aggregated error events per minute."""
+
+    def __init__(self, limit=VK_ERROR_EVENTS_PER_MINUTE):
+        self._limit = limit
+        self._window = None
+        self._sent = 0
+        self.suppressed = 0
+
+    def allow(self) -> bool:
+        window = int(time.monotonic() // 60)
+        if window != self._window:
+            self._window = window
+            self._sent = 0
+
+        if self._sent >= self._limit:
+            self.suppressed += 1
+            return False
+
+        self._sent += 1
+        return True
+
+
+event_rate = _EventRate()
+
+
+class _ErrorGroup:
+    def __init__(self, error):
+        self.error = error
+        self.count = 0
+        self.sample = []
+        self.campaign_ids = set()
+        self.group_ids = set()
+        self.extra = None
+
+
+class ErrorReporter:
+    """
+    Collects failures of a job and sends one Sentry event per
+    (job, error key, level) with the number of failures, a sample of the
+    failed ids (reservoir-sampled when there are many) and campaigns /
+    groups involved. Events over VK_ERROR_EVENTS_PER_MINUTE per process
+    are dropped and counted in the next event sent.
+    """
+
+    def __init__(self, job, sample_size=VK_ERROR_SAMPLE_SIZE, rate=event_rate):
+        self._job = job
+        self._sample_size = sample_size
+        self._rate = rate
+        self._groups = {}
+
+    def __len__(self):
+        return sum(group.count for group in self._groups.values())
+
+    def add(self, entity, error, level='error', key=None):
+        key = (error_key(error) if key is None else str(key), level)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = _ErrorGroup(error)
+            group.extra = entity_extra(entity)
+
+        group.count += 1
+        group.campaign_ids.add(getattr(entity, 'campaign_id', None))
+        group.group_ids.add(getattr(entity, 'group_id', None))
+
+        if len(group.sample) < self._sample_size:
+            group.sample.append(entity.pk)
+        else:
+            index = random.randrange(group.count)
+            if index < self._sample_size:
+                group.sample[index] = entity.pk
+
+    def flush(self):
+        for (key, level), group in self._groups.items():
+            if not self._rate.allow():
+                continue
+
+            suppressed, self._rate.suppressed = self._rate.suppressed, 0
+            log = sentry_logger.warning if level == 'warning' else sentry_logger.error
+            log(msg='{}: {} x {}'.format(self._job, group.count, key), extra={
+                'error': group.error,
+                'count': group.count,
+                'sample_ids': group.sample,
+                'campaign_ids': sorted(pk for pk in group.campaign_ids if pk is not None),
+                'group_ids': sorted(pk for pk in group.group_ids if pk is not None),
+                'first': group.extra,
+                'suppressed_events': suppressed
+            })
+
+        self._groups.clear()
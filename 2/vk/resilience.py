@@ -0,0 +1,144 @@
+import asyncio
+import random
+import time
+
+from application import settings
+from platforms.utils import VK_MESSAGE_KEY
+from platforms.vk import logger
+
+VK_RETRY_ATTEMPTS = getattr(settings, 'VK_RETRY_ATTEMPTS', 4)
+VK_RETRY_BASE_DELAY = getattr(settings, 'VK_RETRY_BASE_DELAY', 0.5)
+VK_RETRY_MAX_DELAY = getattr(settings, 'VK_RETRY_MAX_DELAY', 30)
+VK_BREAKER_THRESHOLD = getattr(settings, 'VK_BREAKER_THRESHOLD', 5)
+VK_BREAKER_RESET_TIMEOUT = getattr(settings, 'VK_BREAKER_RESET_TIMEOUT', 30)
+
+# error_code 1: Unknown error, 6: Too many requests per second, 10: Internal server error
+RETRYABLE_ERROR_CODES = (1, 6, 10)
+
+
+def backoff_delay(attempt, base=VK_RETRY_BASE_DELAY, max_delay=VK_RETRY_MAX_DELAY) -> float:
+    """Exponential backoff with full jitter: uniform(0, base * 2 ** attempt)."""
+    return random.uniform(0, min(max_delay, base * 2 ** attempt))
+
+
+def is_retryable_error(error_dict) -> bool:
+    return bool(error_dict) and error_dict.get(VK_MESSAGE_KEY.ERROR_CODE) in RETRYABLE_ERROR_CODES
+
+
+def is_retryable_response(response_dict) -> bool:
+    if not response_dict:
+        return True
+    return is_retryable_error(response_dict.get(VK_MESSAGE_KEY.ERROR))
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures: calls wait for
+    `reset_timeout` seconds instead of hitting VK, then a single trial
+    call decides whether the breaker closes or opens again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold=VK_BREAKER_THRESHOLD, reset_timeout=VK_BREAKER_RESET_TIMEOUT):
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self._reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def wait_time(self) -> float:
+        """Seconds until a call may be made, 0 - right now."""
+        state = self.state
+        if state == self.CLOSED:
+            return 0.0
+        if state == self.HALF_OPEN and not self._trial:
+            self._trial = True
+            return 0.0
+        if state == self.HALF_OPEN:
+            return self._reset_timeout / 10
+        return self._opened_at + self._reset_timeout - time.monotonic()
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def release_trial(self):
+        """Gives up the trial call without a verdict, e.g. when it was cancelled."""
+        self._trial = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self._trial or self._failures >= self._threshold:
+            if self._opened_at is None or self._trial:
+                logger.warning('VK circuit breaker opened after {} failures'.format(self._failures))
+            self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class CircuitBreakers:
+    """Breakers per key, e.g. (access token, method family) or a method name."""
+
+    def __init__(self, **breaker_kwargs):
+        self._breaker_kwargs = breaker_kwargs
+        self._breakers = {}
+
+    def get(self, key) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(**self._breaker_kwargs)
+        return breaker
+
+    async def wait(self, key):
+        breaker = self.get(key)
+        delay = breaker.wait_time()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = breaker.wait_time()
+        return breaker
+
+
+circuit_breakers = CircuitBreakers()
+
+
+async def call_with_retry(func, key, is_retryable=is_retryable_response, attempts=VK_RETRY_ATTEMPTS,
+                          breakers=circuit_breakers):
+    """
+    Calls `func()` (a coroutine factory) until its result is not retryable,
+    up to `attempts` times, sleeping with jittered exponential backoff
+    between attempts and waiting while the breaker of `key` is open.
+    Returns the last result; the last exception is re-raised.
+    """
+    for attempt in range(attempts):
+        breaker = await breakers.wait(key)
+        try:
+            result = await func()
+        except Exception:
+            breaker.record_failure()
+            if attempt == attempts - 1:
+                raise
+        except BaseException:
+            # отмененный пробный вызов не должен навсегда занять half-open
+            breaker.release_trial()
+            raise
+        else:
+            if not is_retryable(result):
+                breaker.record_success()
+                return result
+
+            breaker.record_failure()
+            if attempt == attempts - 1:
+                return result
+
+        await asyncio.sleep(backoff_delay(attempt))
@@ -0,0 +1,92 @@
+import asyncio
+import contextlib
+
+from application import settings
+from platforms.vk.http import (
+    VK_POOLED_HTTP,
+    vk_http
+)
+from platforms.vk.rate_limit import (
+    method_family,
+    rate_limiter
+)
+
+VK_MAX_CONCURRENT_REQUESTS = getattr(settings, 'VK_MAX_CONCURRENT_REQUESTS', 50)
+
+
+class TokenGates:
+    """
+    FIFO gate per (access token, method family): at most `limit` requests
+    of one key are past the gate at a time. Gates of idle keys are dropped.
+    """
+
+    def __init__(self):
+        self._gates = {}
+
+    @contextlib.asynccontextmanager
+    async def enter(self, key, limit):
+        gate = self._gates.get(key)
+        if gate is None:
+            gate = self._gates[key] = [asyncio.Semaphore(limit), 0]
+
+        gate[1] += 1
+        try:
+            async with gate[0]:
+                yield
+        finally:
+            gate[1] -= 1
+            if not gate[1]:
+                del self._gates[key]
+
+
+class ExecuteScheduler:
+    """
+    Runs VK requests concurrently: every (access token, method family) is
+    kept within its rate limit by `rate_limiter`, which is shared by all
+    worker processes, and the total number of in-flight requests of the
+    process is capped by a semaphore.
+
+    A request waits for its rate slot before it takes the semaphore, so a
+    token sleeping on its limit never holds concurrency slots of other
+    tokens. Per-token gates let only `limit` requests of a token compete
+    for the semaphore, so a slot is not spent long after it was granted.
+
+    With `http` set, requests go through that pooled client instead of
+    the method's own sender.
+    """
+
+    def __init__(self, limiter=rate_limiter, max_concurrency=VK_MAX_CONCURRENT_REQUESTS,
+                 http=vk_http if VK_POOLED_HTTP else None):
+        self._limiter = limiter
+        self._max_concurrency = max_concurrency
+        self._http = http
+        self._semaphore = None
+        self._gates = TokenGates()
+
+    @property
+    def limiter(self):
+        return self._limiter
+
+    def use_http(self, http):
+        """Routes the requests through a pooled VkHttpClient, `None` - through the methods' own sender."""
+        self._http = http
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # создаем лениво, чтобы семафор был привязан к event loop воркера
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._semaphore
+
+    async def execute(self, access_token, method) -> dict:
+        family = method_family(method)
+        async with self._gates.enter((access_token, family), self._limiter.limit(family)):
+            # ожидание слота не занимает общий семафор
+            await self._limiter.acquire(access_token, family)
+            async with self.semaphore:
+                if self._http is not None:
+                    return await self._http.call_method(method)
+                return await method.execute()
+
+
+execute_scheduler = ExecuteScheduler()
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import time
+
+from application import settings
+from platforms.utils import (
+    split_list,
+    format_post_ids,
+    VK_MESSAGE_KEY
+)
+from platforms.vk.execute_batcher import (
+    ExecuteResult,
+    execute_batcher
+)
+from platforms.vk.methods.vk_methods.execute import ExecuteMethod
+from platforms.vk.token_pool import TokenPool
+
+VK_POST_SNAPSHOT_TTL = getattr(settings, 'VK_POST_SNAPSHOT_TTL', 60)
+VK_POST_SNAPSHOT_MAX_SIZE = getattr(settings, 'VK_POST_SNAPSHOT_MAX_SIZE', 50000)
+
+
+class PostSnapshotFetcher:
+    """
+    Shared `wall.getById` snapshot of posts with a short TTL.
+
+    Existence / attachment checks and likes / reposts collection read the
+    same items, so a post refreshed by one of them is not requested again
+    by the other while its snapshot is fresh. A snapshot of `None` means
+    VK did not return the post (it was deleted).
+    """
+
+    CHUNK_SIZE = 100
+
+    def __init__(self, batcher=execute_batcher, ttl=VK_POST_SNAPSHOT_TTL, max_size=VK_POST_SNAPSHOT_MAX_SIZE):
+        self._batcher = batcher
+        self._ttl = ttl
+        self._max_size = max_size
+        self._items = {}
+
+    def _get_fresh(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+
+        if item[0] < time.monotonic():
+            del self._items[key]
+            return None
+        return item
+
+    def _purge(self):
+        now = time.monotonic()
+        for key in [key for key, item in self._items.items() if item[0] < now]:
+            del self._items[key]
+
+    async def fetch(self, tokens, group_id, posts, priority=None):
+        """
+        Returns `(snapshots, failed)`: `snapshots` maps VK post id of every
+        fetched post to its `wall.getById` item (or `None`), `failed` holds
+        ExecuteResult of chunks that could not be fetched.
+
+        `tokens` is an access token or a TokenPool of the group; chunks are
+        spread over the pool's tokens.
+        """
+        if not isinstance(tokens, TokenPool):
+            tokens = TokenPool([tokens])
+
+        snapshots = {}
+        missing = []
+        for post in posts:
+            item = self._get_fresh((group_id, post.post_id))
+            if item is None:
+                missing.append(post)
+            else:
+                snapshots[post.post_id] = item[1]
+
+        if not missing:
+            return snapshots, []
+
+        results = await asyncio.gather(*(
+            self._fetch_chunk(tokens, group_id, posts_chunk, priority)
+            for posts_chunk in split_list(missing, self.CHUNK_SIZE)
+        ))
+
+        if len(self._items) > self._max_size:
+            self._purge()
+
+        failed = []
+        expires_at = time.monotonic() + self._ttl
+        for result in results:
+            if result.is_failed:
+                failed.append(result)
+                continue
+
+            response_items = {item.get(VK_MESSAGE_KEY.ID): item for item in result.response}
+            for post in result.entity:
+                item = response_items.get(post.post_id)
+                self._items[(group_id, post.post_id)] = (expires_at, item)
+                snapshots[post.post_id] = item
+
+        return snapshots, failed
+
+    async def _fetch_chunk(self, tokens, group_id, posts_chunk, priority):
+        call = ExecuteMethod.construct(
+            ExecuteMethod.WALL_ENTITY,
+            ExecuteMethod.GET_BY_ID,
+            json.dumps({
+                VK_MESSAGE_KEY.POSTS: format_post_ids(group_id, posts_chunk),
+            })
+        )
+
+        # при отказе токена запрос повторяется со следующим токеном пула
+        result = ExecuteResult(posts_chunk)
+        for _ in range(len(tokens)):
+            access_token = tokens.pick()
+            if access_token is None:
+                break
+
+            result = await self._batcher.call(access_token, call, posts_chunk, priority)
+            tokens.report(access_token, result)
+            if not result.is_request_failed:
+                break
+        return result
+
+    def invalidate(self, group_id, post_id):
+        self._items.pop((group_id, post_id), None)
+
+    def clear(self):
+        self._items.clear()
+
+
+post_snapshots = PostSnapshotFetcher()
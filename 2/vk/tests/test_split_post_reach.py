@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+from unittest import TestCase
+
+from platforms.utils import VK_MESSAGE_KEY
+from platforms.vk.execute_batcher import ExecuteResult
+from platforms.vk.methods.get_stats_post import split_post_reach
+
+
+def make_post(post_id):
+    return SimpleNamespace(pk=post_id * 10, post_id=post_id)
+
+
+def reach_item(post_id, total):
+    return {VK_MESSAGE_KEY.POST_ID: post_id, 'reach_subscribers': total // 2, 'reach_total': total}
+
+
+class SplitPostReachTestCase(TestCase):
+
+    def test_items_are_matched_by_post_id(self):
+        posts = [make_post(1), make_post(2), make_post(3)]
+        response_dict = {VK_MESSAGE_KEY.RESPONSE: []}
+        # VK не обязан соблюдать порядок post_ids
+        response = [reach_item(3, 30), reach_item(1, 10), reach_item(2, 20)]
+
+        results = split_post_reach([ExecuteResult(posts, response, None, response_dict)])
+
+        self.assertEqual([result.entity for result in results], posts)
+        self.assertEqual([result.response[0]['reach_total'] for result in results], [10, 20, 30])
+        self.assertTrue(all(result.response_dict is response_dict for result in results))
+
+    def test_post_missing_from_response_gets_empty_response(self):
+        posts = [make_post(1), make_post(2)]
+        response_dict = {VK_MESSAGE_KEY.RESPONSE: []}
+
+        results = split_post_reach([ExecuteResult(posts, [reach_item(2, 20)], None, response_dict)])
+
+        self.assertEqual(results[0].response, [])
+        self.assertFalse(results[0].is_failed)
+        self.assertEqual(results[1].response[0]['reach_total'], 20)
+
+    def test_failed_call_error_is_kept_for_every_post(self):
+        posts = [make_post(1), make_post(2)]
+        error = {VK_MESSAGE_KEY.ERROR_CODE: 15}
+        response_dict = {VK_MESSAGE_KEY.RESPONSE: [False]}
+
+        results = split_post_reach([ExecuteResult(posts, False, error, response_dict)])
+
+        self.assertEqual([result.entity for result in results], posts)
+        self.assertTrue(all(result.is_failed and result.error == error for result in results))
+
+    def test_results_of_several_chunks_keep_order(self):
+        first, second = [make_post(1)], [make_post(2), make_post(3)]
+        response_dict = {VK_MESSAGE_KEY.RESPONSE: []}
+
+        results = split_post_reach([
+            ExecuteResult(first, [reach_item(1, 10)], None, response_dict),
+            ExecuteResult(second, [reach_item(2, 20), reach_item(3, 30)], None, response_dict),
+        ])
+
+        self.assertEqual([result.entity.post_id for result in results], [1, 2, 3])
@@ -0,0 +1,101 @@
+from collections import defaultdict
+
+from core.models import UserGroup
+from platforms.utils import VK_MESSAGE_KEY
+from platforms.vk import logger
+from platforms.vk.credentials import (
+    credentials_cache,
+    is_auth_error
+)
+from platforms.vk.methods.vk_methods.execute import ExecuteMethod
+from platforms.vk.rate_limit import rate_limiter
+
+EXECUTE_FAMILY = ExecuteMethod.METHOD
+
+
+class TokenPool:
+    """
+    Access tokens which may be used for calls to one group.
+
+    `pick` returns the healthiest token with the most spare rate budget:
+    tokens with fewer recent failures first, then the ones with more
+    rate budget left in the current window (as last reported by the
+    rate limiter backend) and fewer calls in flight.
+    Tokens rejected by VK as unauthorized are dropped from the pool.
+    """
+
+    def __init__(self, tokens, limiter=rate_limiter, family=EXECUTE_FAMILY):
+        self._tokens = list(dict.fromkeys(token for token in tokens if token))
+        self._limiter = limiter
+        self._family = family
+        self._failures = defaultdict(int)
+        self._in_flight = defaultdict(int)
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __bool__(self):
+        return bool(self._tokens)
+
+    @property
+    def tokens(self) -> list:
+        return list(self._tokens)
+
+    def _score(self, token):
+        return (
+            self._failures[token],
+            self._in_flight[token] - self._limiter.available(token, self._family)
+        )
+
+    def pick(self):
+        if not self._tokens:
+            return None
+
+        token = min(self._tokens, key=self._score)
+        self._in_flight[token] += 1
+        return token
+
+    def report(self, token, result):
+        """Updates the token health with the ExecuteResult of a call made with it."""
+        self._in_flight[token] = max(0, self._in_flight[token] - 1)
+
+        error = result.response_dict.get(VK_MESSAGE_KEY.ERROR) if result.response_dict else None
+        if is_auth_error(error):
+            self.drop(token)
+        elif result.is_request_failed:
+            self._failures[token] += 1
+        else:
+            self._failures.pop(token, None)
+
+    def drop(self, token):
+        if token in self._tokens:
+            self._tokens.remove(token)
+
+
+def load_group_token_pools(groups) -> dict:
+    """
+    Builds a TokenPool for every group (with `custom_prefetch_posts`) from
+    tokens of the group admins and of the post owners. Returns {group.pk: pool}.
+    """
+    user_ids_by_group = defaultdict(list)
+    for group in groups:
+        user_ids_by_group[group.pk].extend(post.user_id for post in group.custom_prefetch_posts)
+
+    admins = UserGroup.objects.filter(group_id__in=list(user_ids_by_group)).values_list('group_id', 'user_id')
+    for group_id, user_id in admins:
+        user_ids_by_group[group_id].append(user_id)
+
+    credentials_cache.prefetch(
+        user_id for user_ids in user_ids_by_group.values() for user_id in user_ids
+    )
+
+    pools = {}
+    for group_id, user_ids in user_ids_by_group.items():
+        tokens = []
+        for user_id in dict.fromkeys(user_ids):
+            try:
+                tokens.append(credentials_cache.get(user_id)[1])
+            except Exception as e:
+                logger.error(e)
+        pools[group_id] = TokenPool(tokens)
+    return pools
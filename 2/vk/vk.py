@@ -11,6 +11,7 @@ from platforms.vk.methods.get_stats_post import GetStatsPosts
 from platforms.vk.methods.get_stats_video import GetStatsVideo
 from platforms.vk.methods.get_user_groups import GetUserGroups
 from platforms.vk.methods.post_vk_screenshot import PostVKScreenshot
+from platforms.vk.methods.refresh_posts import RefreshPosts
 from platforms.vk.methods.send_message import SendMessage
 
 
@@ -31,6 +32,7 @@ class VKPlatform(
     GetStatsGroup,
     GetStatsPosts,
     GetLikesReposts,
+    RefreshPosts,
     DelayPost,
     CheckPost,
 ):
@@ -0,0 +1,253 @@
+import asyncio
+import enum
+import time
+import weakref
+
+from collections import OrderedDict
+from logging import getLogger
+
+logger = getLogger('game_flusher')
+
+
+class FlusherClosedError(RuntimeError):
+    pass
+
+
+class Mutation:
+    class Kind(enum.Enum):
+        shoot_count = 'shoot_count'
+        score = 'score'
+        start = 'start'
+        stop = 'stop'
+
+    def __init__(self, kind, game_id, value=0, args=(), future=None):
+        self.kind = kind
+        self.game_id = game_id
+        self.value = value
+        self.args = args
+        self.future = future
+        # re-queued after a failed flush: already counted in `mutations`
+        self.retried = False
+
+    @property
+    def is_increment(self):
+        return self.kind in (Mutation.Kind.shoot_count, Mutation.Kind.score)
+
+
+class GameStoreFlusher:
+    """
+    Collects game mutations from all rooms of the worker and writes them
+    to the store once per `interval` milliseconds.
+
+    Mutations of one game are applied strictly in the order they were
+    submitted; consecutive increments are merged into a single store call.
+    Mutations that failed to reach the store are retried with exponential
+    backoff up to `max_retries` times, then dropped and their waiters get
+    the error. The flush loop starts on the first submitted mutation.
+    """
+
+    def __init__(self, game_rooms, interval=50, max_retries=5, max_backoff=5000):
+        self._game_rooms = weakref.ref(game_rooms)
+        self._interval = interval
+        self._max_retries = max_retries
+        self._max_backoff = max_backoff
+
+        self._pending = OrderedDict()
+        self._task = None
+        self._closing = False
+        self._stop_event = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._failures = {}
+
+        self.flushes = 0
+        self.mutations = 0
+        self.store_ops = 0
+
+    @property
+    def store(self):
+        game_rooms = self._game_rooms()
+        if game_rooms is None:
+            return None
+        return game_rooms.store
+
+    @property
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.is_running:
+            self._closing = False
+            self._stop_event.clear()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        self._closing = True
+        if self._task is not None:
+            # the loop is stopped, not cancelled: a flush in progress is
+            # awaited, otherwise its swapped-out batch would be lost
+            self._stop_event.set()
+            await self._task
+            self._task = None
+
+        # durability on shutdown: nothing submitted before close() is lost
+        await self.flush(force=True)
+        if self._pending:
+            logger.error(f"Flusher closed with unsaved mutations of games {list(self._pending)}")
+            for mutations in self._pending.values():
+                self._fail(mutations, FlusherClosedError('Flusher is closed'))
+        logger.info(f"Flusher closed: {self.report()}")
+
+    def inc_shoot_count(self, game_id, count):
+        self._submit(Mutation(Mutation.Kind.shoot_count, game_id, count))
+
+    def inc_score(self, game_id, score):
+        self._submit(Mutation(Mutation.Kind.score, game_id, score))
+
+    async def start_game(self, game_id):
+        return await self._submit_and_wait(Mutation.Kind.start, game_id)
+
+    async def stop_game(self, game_id, score_front, has_promo):
+        return await self._submit_and_wait(Mutation.Kind.stop, game_id,
+                                           args=(score_front, has_promo))
+
+    async def flush(self, game_id=None, force=False):
+        """
+        Writes pending mutations of all games or of `game_id` only. Games
+        backing off after a failure are skipped unless `force` is set.
+        """
+        async with self._flush_lock:
+            if game_id is not None:
+                game_ids = [game_id] if game_id in self._pending else []
+            else:
+                now = time.monotonic()
+                game_ids = [
+                    pending_id for pending_id in self._pending
+                    if force or self._failures.get(pending_id, (0, 0))[1] <= now
+                ]
+
+            if not game_ids:
+                return
+
+            pending = OrderedDict((pending_id, self._pending.pop(pending_id)) for pending_id in game_ids)
+
+            self.flushes += 1
+            self.mutations += sum(1 for ms in pending.values() for m in ms if not m.retried)
+
+            # the batch is already out of self._pending: cancelling the
+            # caller must not abort its store writes halfway
+            await asyncio.shield(asyncio.gather(*(
+                self._apply(game_id, mutations)
+                for game_id, mutations in pending.items()
+            )))
+
+    def report(self):
+        avg_batch_size = self.mutations / self.flushes if self.flushes else 0
+        saved = self.mutations - self.store_ops
+        return {
+            'flushes': self.flushes,
+            'mutations': self.mutations,
+            'store_ops': self.store_ops,
+            'avg_batch_size': round(avg_batch_size, 2),
+            'store_ops_saved': saved,
+            'store_ops_reduction': round(saved / self.mutations, 4) if self.mutations else 0,
+        }
+
+    def _submit(self, mutation):
+        if self._closing:
+            raise FlusherClosedError(f"Flusher is closed, {mutation.kind.value} of game {mutation.game_id} is rejected")
+        self._pending.setdefault(mutation.game_id, []).append(mutation)
+        self.start()
+
+    async def _submit_and_wait(self, kind, game_id, args=()):
+        future = asyncio.get_event_loop().create_future()
+        self._submit(Mutation(kind, game_id, args=args, future=future))
+        return await future
+
+    async def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), self._interval / 1000)
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception(e)
+
+    def _requeue(self, game_id, mutations, error):
+        attempts = self._failures.get(game_id, (0, 0))[0] + 1
+        if attempts > self._max_retries:
+            logger.error(f"Dropping {len(mutations)} mutations of game {game_id} "
+                         f"after {attempts} failed flushes: {error}")
+            self._failures.pop(game_id, None)
+            self._fail(mutations, error)
+            return
+
+        backoff = min(self._max_backoff, self._interval * 2 ** attempts)
+        self._failures[game_id] = (attempts, time.monotonic() + backoff / 1000)
+
+        for m in mutations:
+            m.retried = True
+        # ahead of everything submitted while the failed batch was in flight
+        self._pending[game_id] = mutations + self._pending.get(game_id, [])
+
+    @staticmethod
+    def _fail(mutations, error):
+        for m in mutations:
+            if m.future is not None and not m.future.done():
+                m.future.set_exception(error)
+
+    async def _apply(self, game_id, mutations):
+        game_store = self.store.game
+        shoot_count, score = 0, 0
+
+        async def apply_increments():
+            nonlocal shoot_count, score
+            if shoot_count:
+                await game_store.inc_shoot_count(game_id, shoot_count)
+                self.store_ops += 1
+                shoot_count = 0
+            if score:
+                await game_store.inc_score(game_id, score)
+                self.store_ops += 1
+                score = 0
+
+        position = 0
+        try:
+            for position, m in enumerate(mutations):
+                if m.kind == Mutation.Kind.shoot_count:
+                    shoot_count += m.value
+                    continue
+                if m.kind == Mutation.Kind.score:
+                    score += m.value
+                    continue
+
+                # start/stop are barriers: everything submitted before
+                # them must reach the store first
+                await apply_increments()
+
+                if m.kind == Mutation.Kind.start:
+                    game = await game_store.start(game_id)
+                else:
+                    game = await game_store.stop(game_id, *m.args)
+                self.store_ops += 1
+                m.future.set_result(game)
+
+            position = len(mutations)
+            await apply_increments()
+            self._failures.pop(game_id, None)
+        except Exception as e:
+            logger.error(f"Failed to flush game {game_id}: {e}")
+
+            rest = mutations[position:]
+            if rest and not rest[0].is_increment and not shoot_count and not score:
+                # the start/stop itself failed - the room gets the error
+                rest.pop(0).future.set_exception(e)
+
+            requeued = []
+            if shoot_count:
+                requeued.append(Mutation(Mutation.Kind.shoot_count, game_id, shoot_count))
+            if score:
+                requeued.append(Mutation(Mutation.Kind.score, game_id, score))
+            self._requeue(game_id, requeued + rest, e)
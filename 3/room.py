@@ -10,6 +10,7 @@ import weakref
 from logging import getLogger
 from socketio import AsyncServer
 
+from domestosgame.game.flusher import GameStoreFlusher
 from domestosgame.game.microbe import MicrobeFactory
 from domestosgame.store.models.core import Game
 from settings import settings
@@ -24,6 +25,9 @@ class GameRooms:
         self._rooms = {}
         self._sid_to_room = {}
 
+        flush_interval = settings.config.get('game', {}).get('flush_interval', 50)
+        self._flusher = GameStoreFlusher(self, interval=flush_interval)
+
     @property
     def app(self):
         return self._app()
@@ -32,6 +36,17 @@ class GameRooms:
     def store(self):
         return self.app.store
 
+    @property
+    def flusher(self):
+        return self._flusher
+
+    async def startup(self):
+        # optional: the flusher also starts on the first submitted mutation
+        self._flusher.start()
+
+    async def shutdown(self):
+        await self._flusher.close()
+
     @property
     def server(self):
         return self._sio_namespace
@@ -128,6 +143,10 @@ class Room:
             return None
         return self.rooms.store
 
+    @property
+    def flusher(self) -> GameStoreFlusher:
+        return self.rooms.flusher
+
     async def has_promo(self):
         return await self.store.user.has_promo(self.user_id)
 
@@ -209,6 +228,10 @@ class Room:
         self.gun_sid = None
 
     async def disconnect_all(self):
+        # a game left without screen:game_stop keeps its shots and score
+        if self.game_id is not None:
+            await self.flusher.flush(self.game_id)
+
         if self.screen_sid is not None:
             await self.server.disconnect(self.screen_sid)
 
@@ -260,7 +283,7 @@ class Room:
             'microbes': self._microbe_factory.dump_microbes()
         }
 
-        self._game = await self.store.game.start(self._game.id)
+        self._game = await self.flusher.start_game(self._game.id)
         await self.emit_event(self.screen_sid, 'screen:game_started', resp)
 
         if self.gun_sid is not None:
@@ -298,14 +321,16 @@ class Room:
         if x is None or y is None:
             return
 
-        self._game = await self.store.game.inc_shoot_count(self.game_id, 1)
+        self.flusher.inc_shoot_count(self.game_id, 1)
+        self._game.shoot_count += 1
         has_promo = await self.has_promo()
 
         score, killed_microbes = self._microbe_factory.shoot(x, y,
                                                              has_promo,
                                                              radius)
         if len(killed_microbes) > 0:
-            self._game = await self.store.game.inc_score(self.game_id, score)
+            self.flusher.inc_score(self.game_id, score)
+            self._game.score += score
             await self.emit_event(self.screen_sid, 'screen:killed', {
                 'killed': killed_microbes,
                 'score': self._game.score,
@@ -317,8 +342,8 @@ class Room:
             return
         if not self._game.is_finished(self.cfg_game_duration):
             has_promo = await self.has_promo()
-            self._game = await self.store.game.stop(self.game_id, score_front,
-                                                    has_promo)
+            self._game = await self.flusher.stop_game(self.game_id, score_front,
+                                                      has_promo)
 
             res = {
                 'score': self._game.score,